@@ -0,0 +1,184 @@
+#!python3
+
+"""
+Using cvxpy - the convex optimization package of Python -
+to find a leximin-egalitarian division of divisible resources, for any number of players.
+
+The program is built once, with parameters for the saturated players,
+and re-solved after every saturation step (see 3-leximin-saturation.py for the step-by-step version).
+"""
+
+import cvxpy, time
+import numpy as np
+from itertools import combinations
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def leximin(value_matrix, tolerance:float=1e-6, solver=None, **solver_options):
+    """
+    Find a leximin-egalitarian division: maximize the smallest utility; subject to that, the second-smallest; etc.
+
+    In every iteration, the free (non-saturated) players get at least some common utility z, which is maximized,
+    while every saturated player keeps his saturation value.
+    The players whose constraint "z <= utility" has a positive dual value cannot get more than z
+    in any optimal solution (by complementary slackness), so they become saturated with value z.
+    At least one such player exists, since the dual values of these constraints sum to 1.
+    Hence, at most n programs are solved, and no extra program is needed for checking each free player.
+
+    :param value_matrix: a matrix whose [i,j] element is the value of player i for resource j (one unit of each resource).
+    :param tolerance: dual values above this are considered positive; saturation values are relaxed by this amount.
+    :param solver, solver_options: passed to cvxpy's solve.
+    :return: the allocation matrix (the [i,j] element is the fraction of resource j given to player i), and the utilities.
+
+    >>> values = [[4,0,0], [0,3,0], [5,5,10], [5,5,10]]   # players A,B,C,D; resources wood, oil, steel
+    >>> allocation, utilities = leximin(values)
+    >>> np.round(utilities, 3).tolist()
+    [4.0, 3.0, 5.0, 5.0]
+    >>> np.round(allocation.sum(axis=0), 3).tolist()
+    [1.0, 1.0, 1.0]
+    """
+    values = np.array(value_matrix, dtype=float)
+    num_of_players, num_of_resources = values.shape
+    allocation = cvxpy.Variable((num_of_players, num_of_resources), nonneg=True)
+    utilities = cvxpy.sum(cvxpy.multiply(values, allocation), axis=1)
+    min_utility = cvxpy.Variable()
+    is_free = cvxpy.Parameter(num_of_players, nonneg=True)              # 1 for free players, 0 for saturated players
+    saturation_values = cvxpy.Parameter(num_of_players)                  # lower bounds on the utilities
+    min_utility_constraint = cvxpy.multiply(is_free, min_utility) <= utilities
+    prob = cvxpy.Problem(
+        cvxpy.Maximize(min_utility),
+        constraints = [
+            cvxpy.sum(allocation, axis=0) == 1,
+            utilities >= saturation_values,
+            min_utility_constraint,
+        ])
+
+    free = np.ones(num_of_players, dtype=bool)
+    lower_bounds = values.clip(max=0).sum(axis=1)     # the smallest possible utilities
+    iteration = 0
+    while free.any():
+        iteration += 1
+        is_free.value = free.astype(float)
+        saturation_values.value = lower_bounds
+        start = time.perf_counter()
+        prob.solve(solver=solver, warm_start=True, **solver_options)
+        if prob.status not in ["optimal", "optimal_inaccurate"]:
+            raise ValueError(f"Iteration {iteration}: solver status is {prob.status}")
+        duals = min_utility_constraint.dual_value
+        saturated = free & (duals > tolerance)
+        if not saturated.any():      # numerical trouble: saturate the free players with the largest dual values
+            saturated = free & (duals >= duals[free].max())
+        free &= ~saturated
+        lower_bounds[saturated] = min_utility.value - tolerance
+        lower_bounds[free] = np.maximum(lower_bounds[free], min_utility.value - tolerance)   # the min utility never decreases
+        logger.info("Iteration %d: min utility %f, %d players saturated, %d free (%.3f seconds)",
+            iteration, min_utility.value, saturated.sum(), free.sum(), time.perf_counter()-start)
+    return allocation.value, utilities.value
+
+
+
+def leximin_by_sums(value_matrix, tolerance:float=1e-6, solver=None, **solver_options):
+    """
+    Find a leximin-egalitarian division by maximizing, for k=1,...,n in turn, the sum of the k smallest utilities,
+    subject to keeping the sums already found (see 3-leximin-sums.py for the step-by-step version).
+
+    The sum of the k smallest utilities is written as in Ogryczak and Sliwinski (2003):
+        max  k*t_k - sum_i d_ik   subject to   d_ik >= t_k - u_i,  d_ik >= 0,
+    so the program has O(n^2) variables and constraints, instead of one constraint per k-subset of players.
+    As in `leximin`, the program is built once, with parameters for the objective and for the sums already found.
+
+    :param value_matrix: a matrix whose [i,j] element is the value of player i for resource j (one unit of each resource).
+    :param tolerance: the sums already found are relaxed by this amount per utility.
+    :param solver, solver_options: passed to cvxpy's solve.
+    :return: the allocation matrix (the [i,j] element is the fraction of resource j given to player i), and the utilities.
+
+    >>> values = [[4,0,0], [0,3,0], [5,5,10], [5,5,10]]   # players A,B,C,D; resources wood, oil, steel
+    >>> allocation, utilities = leximin_by_sums(values)
+    >>> np.round(utilities, 3).tolist()
+    [4.0, 3.0, 5.0, 5.0]
+    """
+    values = np.array(value_matrix, dtype=float)
+    num_of_players, num_of_resources = values.shape
+    allocation = cvxpy.Variable((num_of_players, num_of_resources), nonneg=True)
+    utilities = cvxpy.sum(cvxpy.multiply(values, allocation), axis=1)
+    t = cvxpy.Variable(num_of_players)
+    d = cvxpy.Variable((num_of_players, num_of_players), nonneg=True)   # d[i,k] >= t[k] - u[i]
+    ones = np.ones((num_of_players, 1))
+    sums_of_smallest = cvxpy.multiply(np.arange(1, num_of_players+1), t) - cvxpy.sum(d, axis=0)   # the k-th element is the sum of the k smallest utilities
+    objective_weights = cvxpy.Parameter(num_of_players, nonneg=True)   # selects the sum that is maximized
+    sum_bounds = cvxpy.Parameter(num_of_players)                       # lower bounds on the sums
+    prob = cvxpy.Problem(
+        cvxpy.Maximize(objective_weights @ sums_of_smallest),
+        constraints = [
+            cvxpy.sum(allocation, axis=0) == 1,
+            d >= ones @ cvxpy.reshape(t, (1, num_of_players), order="C") - cvxpy.reshape(utilities, (num_of_players, 1), order="C") @ ones.T,
+            sums_of_smallest >= sum_bounds,
+        ])
+
+    smallest_possible_utility = values.clip(max=0).sum(axis=1).min()
+    bounds = np.arange(1, num_of_players+1) * smallest_possible_utility - 1
+    for k in range(num_of_players):
+        objective_weights.value = np.eye(num_of_players)[k]
+        sum_bounds.value = bounds
+        start = time.perf_counter()
+        prob.solve(solver=solver, warm_start=True, **solver_options)
+        if prob.status not in ["optimal", "optimal_inaccurate"]:
+            raise ValueError(f"Iteration {k+1}: solver status is {prob.status}")
+        bounds[k] = prob.value - tolerance*(k+1)   # a sum of k+1 utilities has k+1 rounding errors
+        logger.info("Iteration %d: the sum of the %d smallest utilities is %f (%.3f seconds)", k+1, k+1, prob.value, time.perf_counter()-start)
+    return allocation.value, utilities.value
+
+
+def leximin_by_sums_of_combinations(value_matrix, tolerance:float=1e-5, solver=None, **solver_options):
+    """
+    The same as leximin_by_sums, with one constraint per subset of k players, as in 3-leximin-sums.py.
+    The number of constraints is exponential in n; this function is kept for comparison.
+    Its many near-duplicate constraints need a larger tolerance to remain numerically feasible.
+
+    >>> allocation, utilities = leximin_by_sums_of_combinations([[4,0,0], [0,3,0], [5,5,10], [5,5,10]])
+    >>> np.round(utilities, 3).tolist()
+    [4.0, 3.0, 5.0, 5.0]
+    """
+    values = np.array(value_matrix, dtype=float)
+    num_of_players, num_of_resources = values.shape
+    allocation = cvxpy.Variable((num_of_players, num_of_resources), nonneg=True)
+    utilities = cvxpy.sum(cvxpy.multiply(values, allocation), axis=1)
+    constraints = [cvxpy.sum(allocation, axis=0) == 1]
+    for k in range(1, num_of_players+1):
+        min_sum = cvxpy.Variable()
+        subset_sums = [sum(utilities[i] for i in subset) for subset in combinations(range(num_of_players), k)]
+        prob = cvxpy.Problem(cvxpy.Maximize(min_sum), constraints + [min_sum <= subset_sum for subset_sum in subset_sums])
+        prob.solve(solver=solver, **solver_options)
+        if prob.status not in ["optimal", "optimal_inaccurate"]:
+            raise ValueError(f"Iteration {k}: solver status is {prob.status}")
+        constraints += [min_sum.value - tolerance*k <= subset_sum for subset_sum in subset_sums]   # a sum of k utilities has k rounding errors
+    return allocation.value, utilities.value
+
+if __name__ == "__main__":
+    import doctest, sys
+    (failures,tests) = doctest.testmod(report=True)
+    print ("{} failures, {} tests".format(failures,tests))
+
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.INFO)
+    num_of_players, num_of_resources = 200, 500
+    values = np.random.randint(0, 100, (num_of_players, num_of_resources))
+    start = time.perf_counter()
+    solver = cvxpy.HIGHS if cvxpy.HIGHS in cvxpy.installed_solvers() else None
+    allocation, utilities = leximin(values, solver=solver)
+    print("{} players, {} resources: {:.3f} seconds. Smallest utilities: {}".format(
+        num_of_players, num_of_resources, time.perf_counter()-start, np.sort(utilities)[:5].round(3)))
+
+    logger.setLevel(logging.WARNING)
+    print("\nLeximin by sums: Ogryczak formulation vs. combinations")
+    for num_of_players in range(2, 13, 2):
+        values = np.random.randint(0, 100, (num_of_players, 5)) * (np.random.rand(num_of_players, 5) < 0.5)
+        start = time.perf_counter()
+        _, utilities = leximin_by_sums(values, solver=solver)
+        middle = time.perf_counter()
+        _, utilities_of_combinations = leximin_by_sums_of_combinations(values, solver=solver)
+        end = time.perf_counter()
+        print("{} players: {:.3f} seconds vs. {:.3f} seconds; same sorted utilities: {}".format(
+            num_of_players, middle-start, end-middle, np.allclose(np.sort(utilities), np.sort(utilities_of_combinations), atol=1e-4)))
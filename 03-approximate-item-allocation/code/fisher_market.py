@@ -0,0 +1,101 @@
+#!python3
+
+"""
+Maximizing the product of utilities (Nash social welfare) in a fractional allocation with additive valuations,
+by computing a Fisher-market equilibrium with equal budgets (Eisenberg and Gale, 1959).
+
+The equilibrium is computed by proportional-response dynamics (Wu and Zhang, 2007; Birnbaum, Devanur and Xiao, 2011):
+every agent splits its budget among the items in proportion to the value it got from each item in the previous round.
+Every round takes time linear in the number of positive values, so large sparse instances are handled quickly.
+"""
+
+import time
+import numpy as np
+from scipy import sparse
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def max_product_fisher(value_matrix, budgets=None, tolerance:float=1e-6, max_iterations:int=100000):
+    """
+    Calculate an allocation that maximizes the product of utilities (weighted by the budgets), and the market-clearing prices.
+
+    The dynamics stop when the allocation is a (1+tolerance)-approximate equilibrium:
+    for every agent i and item j, value[i,j]/price[j] <= (1+tolerance) * utility[i]/budget[i],
+    i.e., every agent buys only items that have (almost) maximum value per unit of money.
+
+    :param value_matrix: a matrix (dense or scipy.sparse): value_matrix[i][j] is the value of agent i for all of item j.
+                         Every agent must have a positive value for some item.
+    :param budgets: the budget of each agent (default: 1 for all agents, which gives the maximum Nash welfare).
+    :param tolerance: the approximation tolerance of the equilibrium.
+    :param max_iterations: the maximum number of rounds.
+    :return: the allocation (a sparse matrix: allocation[i,j] is the fraction of item j given to agent i), and the prices.
+
+    >>> allocation, prices = max_product_fisher([[6,6,0],[0,0,2]])
+    >>> np.round(allocation.toarray(), 2).tolist(), np.round(prices, 2).tolist()
+    ([[1.0, 1.0, 0.0], [0.0, 0.0, 1.0]], [0.5, 0.5, 1.0])
+    >>> allocation, prices = max_product_fisher([[6,2,7],[1,5,7]])
+    >>> np.round(allocation.toarray(), 2).tolist()
+    [[1.0, 0.0, 0.43], [0.0, 1.0, 0.57]]
+    """
+    values = sparse.csr_matrix(value_matrix, dtype=float)
+    values.eliminate_zeros()
+    num_of_agents, num_of_items = values.shape
+    budgets = np.ones(num_of_agents) if budgets is None else np.asarray(budgets, dtype=float)
+    agents = np.repeat(np.arange(num_of_agents), np.diff(values.indptr))   # the agent of every positive value
+    items = values.indices                                                 # the item of every positive value
+    data = values.data
+    value_sums = np.bincount(agents, weights=data, minlength=num_of_agents)
+    if (value_sums <= 0).any():
+        raise ValueError("Every agent must have a positive value for some item")
+
+    bids = budgets[agents] * data / value_sums[agents]     # start by bidding in proportion to the values
+    start = time.perf_counter()
+    for iteration in range(1, max_iterations+1):
+        prices = np.bincount(items, weights=bids, minlength=num_of_items)
+        values_per_price = data / prices[items]
+        fractions = bids / prices[items]
+        gains = bids * values_per_price            # the value that each agent gets from each item
+        utilities = np.bincount(agents, weights=gains, minlength=num_of_agents)
+        money_per_utility = (budgets / utilities)[agents]
+        gap = (values_per_price * money_per_utility).max() - 1
+        if gap <= tolerance:
+            break
+        bids = gains * money_per_utility
+    else:
+        logger.warning("Stopped after %d iterations; the equilibrium gap is %f", max_iterations, gap)
+    logger.info("%d iterations in %.3f seconds, equilibrium gap %g", iteration, time.perf_counter()-start, gap)
+    allocation = sparse.csr_matrix((fractions, items, values.indptr), shape=values.shape)
+    return allocation, prices
+
+
+if __name__ == "__main__":
+    import doctest, importlib, sys
+    (failures,tests) = doctest.testmod(report=True)
+    print ("{} failures, {} tests".format(failures,tests))
+
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.INFO)
+
+    import cvxpy
+    log_approximation = importlib.import_module("log-approximation")
+    print("\nCross-check against the cvxpy formulation:")
+    for num_of_agents, num_of_items in [(3, 5), (10, 20), (30, 60)]:
+        value_matrix = np.random.randint(0, 10, (num_of_agents, num_of_items))
+        value_matrix[:, 0] += 1
+        allocation, prices = max_product_fisher(value_matrix)
+        objective, constraints, Xig = log_approximation.build_max_product_1(value_matrix)
+        prob = cvxpy.Problem(cvxpy.Maximize(objective), constraints)
+        prob.solve()
+        nash_welfare = np.log(allocation.multiply(value_matrix).sum(axis=1)).sum()
+        print("{} agents, {} items: sum of logs {:.6f} (Fisher market) vs. {:.6f} (cvxpy)".format(
+            num_of_agents, num_of_items, nash_welfare, prob.value))
+
+    print("\nLarge sparse instance:")
+    num_of_agents = num_of_items = 10000
+    value_matrix = sparse.random(num_of_agents, num_of_items, density=0.001, format="csr", data_rvs=lambda size: np.random.randint(1, 100, size))
+    value_matrix += sparse.eye(num_of_agents, num_of_items)   # every agent wants some item
+    start = time.perf_counter()
+    allocation, prices = max_product_fisher(value_matrix, tolerance=1e-3)
+    print("{} agents, {} items, {} positive values: {:.3f} seconds".format(num_of_agents, num_of_items, value_matrix.nnz, time.perf_counter()-start))
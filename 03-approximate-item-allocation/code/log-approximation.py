@@ -8,52 +8,80 @@ This problem is NP-hard, but when the values are small integers, it can be solve
 """
 
 import cvxpy
-import math
+import math, time
 import numpy as np
 
-def feasibility_constraints(Xig:list)->list:
+import logging
+logger = logging.getLogger(__name__)
+
+SOLVER_TOLERANCE = 1e-7   # roughly the feasibility tolerance of the default cvxpy solvers; smaller gaps are numerical noise
+
+
+def allocation_variables(num_of_agents:int, num_of_items:int, integer:bool=False)->cvxpy.Variable:
+    """
+    :return: a matrix variable X: X[i,g] is the amount of good g given to agent i.
+    """
+    return cvxpy.Variable((num_of_agents, num_of_items), integer=integer)
+
+def feasibility_constraints(Xig:cvxpy.Variable)->list:
     """
     Generate the feasibility constraints of the given matrix, namely:
     * Each Xig is between 0 and 1;
     * For each g, the sum of Xig is 1.
-    :param Xig: a list of lists of variables: Xig[i,g] is the amount of good g given to agent i.
+    :param Xig: a matrix variable: Xig[i,g] is the amount of good g given to agent i.
     :return: a list of constraints.
     """
-    constraints = []
-    num_of_agents = len(Xig)
-    num_of_items =  len(Xig[0])
-    for g in range(num_of_items):
-        constraints.append(1 ==
-            sum([Xig[i][g] for i in range(num_of_agents)]))
-        for i in range(num_of_agents):
-            constraints += [Xig[i][g] >= 0, Xig[i][g] <= 1]
-    return constraints
+    return [Xig >= 0, Xig <= 1, cvxpy.sum(Xig, axis=0) == 1]
 
-def solve_and_print(objective, constraints:list, Xig:list, integer:bool=False):
+def agent_values(value_matrix:list, Xig:cvxpy.Variable):
+    """
+    :return: a vector expression: the value of each agent i for its bundle, sum_g value_matrix[i][g]*Xig[i,g].
+    """
+    return cvxpy.sum(cvxpy.multiply(np.array(value_matrix), Xig), axis=1)
+
+def solve_and_print(objective, constraints:list, Xig:cvxpy.Variable, integer:bool=False, build_time:float=None):
     """
     Solve the optimization problem and print the results.
+    The time of building the program (if given), of compiling it, and of solving it are logged separately.
 
     :param objective the cvxpy maximization objective function.
     :param constraints the cvxpy list of constraints.
-    :param Xig: list of lists of cvxpy.Variables.
+    :param Xig: a matrix variable.
     :param integer: True of the variables are whole numbers; False if they can be fractional.
+    :param build_time: the time (in seconds) of building the objective and constraints.
     """
-    num_of_agents = len(Xig)
-    num_of_items =  len(Xig[0])
     prob = cvxpy.Problem(cvxpy.Maximize(objective), constraints)
     prob.solve()
+    logger.info("build time: %s, compilation time: %.3f, solve time: %.3f (%s)",
+        "%.3f" % build_time if build_time is not None else "?", prob.compilation_time, prob.solver_stats.solve_time or 0, prob.solver_stats.solver_name)
+    print_solution(prob, Xig, integer)
+
+def print_solution(prob:cvxpy.Problem, Xig:cvxpy.Variable, integer:bool=False):
+    """
+    Print the status, the maximum product and the allocation of a solved problem.
+    """
+    num_of_agents, num_of_items = Xig.shape
     print("status: ", prob.status)
     print("maximum product: ", round(math.exp(prob.value),1))
     print("allocation:")
     for i in range(num_of_agents):
         for g in range(num_of_items):
             if integer:
-                if Xig[i][g].value > 0.5:
+                if Xig.value[i,g] > 0.5:
                     print("  agent {} gets item {}".format(i, g))
             else:
-                print("  agent {} gets {} of item {}".format(i, np.round(Xig[i][g].value, 2), g))
+                print("  agent {} gets {} of item {}".format(i, np.round(Xig.value[i,g], 2), g))
+
 
 
+def build_max_product_1(value_matrix: list, integer=False):
+    """
+    Build the program of max_product_1.
+    :return: objective, constraints, allocation variable.
+    """
+    Xig = allocation_variables(len(value_matrix), len(value_matrix[0]), integer)   # Xig[i,g] represents the fraction of good g given to agent i. Should be in {0,1}.
+    objective = cvxpy.sum(cvxpy.log(agent_values(value_matrix, Xig)))
+    return objective, feasibility_constraints(Xig), Xig
 
 def max_product_1(value_matrix: list, integer=False):
     """
@@ -61,123 +89,223 @@ def max_product_1(value_matrix: list, integer=False):
 
     >>> max_product_1([[6,6,0],[0,0,2]])
     status:  optimal
-    optimal value:  24.0
+    maximum product:  24.0
     allocation:
-    agent 0 gets 1.0 of item 0
-    agent 0 gets 1.0 of item 1
-    agent 0 gets 0.0 of item 2
-    agent 1 gets 0.0 of item 0
-    agent 1 gets 0.0 of item 1
-    agent 1 gets 1.0 of item 2
+      agent 0 gets 1.0 of item 0
+      agent 0 gets 1.0 of item 1
+      agent 0 gets 0.0 of item 2
+      agent 1 gets 0.0 of item 0
+      agent 1 gets 0.0 of item 1
+      agent 1 gets 1.0 of item 2
     >>> max_product_1([[6,2,7],[1,5,7]])
     status:  optimal
-    optimal value:  81.0
+    maximum product:  81.0
     allocation:
-    agent 0 gets 1.0 of item 0
-    agent 0 gets 0.0 of item 1
-    agent 0 gets 0.43 of item 2
-    agent 1 gets 0.0 of item 0
-    agent 1 gets 1.0 of item 1
-    agent 1 gets 0.57 of item 2
+      agent 0 gets 1.0 of item 0
+      agent 0 gets 0.0 of item 1
+      agent 0 gets 0.43 of item 2
+      agent 1 gets 0.0 of item 0
+      agent 1 gets 1.0 of item 1
+      agent 1 gets 0.57 of item 2
 
     :param value_matrix: list of lists.
     :return: allocation that maximizes the sum of logs.
     """
+    start = time.perf_counter()
+    objective, constraints, Xig = build_max_product_1(value_matrix, integer)
+    solve_and_print(objective, constraints, Xig, integer, time.perf_counter()-start)
 
-    num_of_agents = len(value_matrix)
-    num_of_items =  len(value_matrix[0])
-    Xig = [[cvxpy.Variable(integer=integer)
-            for _ in range(num_of_items)]
-            for _ in range(num_of_agents)]   # Xig[i][g] represents the fraction of good g given to agent i. Should be in {0,1}.
 
-    objective = 0
-    constraints = feasibility_constraints(Xig)
-    for i in range(num_of_agents):
-        value_of_i = sum([Xig[i][g] * value_matrix[i][g]
-                          for g in range(num_of_items)])
-        objective += cvxpy.log(value_of_i)
-    solve_and_print(objective, constraints, Xig, integer)
+def build_max_product_2(value_matrix: list, integer=False):
+    """
+    Build the program of max_product_2.
+    :return: objective, constraints, allocation variable.
+    """
+    Xig = allocation_variables(len(value_matrix), len(value_matrix[0]), integer)   # Xig[i,g] represents the fraction of good g given to agent i. Should be in {0,1}.
+    Wi = cvxpy.Variable(len(value_matrix))                                          # Wi[i] represents the log of the value of agent i
+    constraints = feasibility_constraints(Xig) + [Wi <= cvxpy.log(agent_values(value_matrix, Xig))]
+    return cvxpy.sum(Wi), constraints, Xig
 
 def max_product_2(value_matrix: list, integer=False):
     """
     >>> max_product_2([[6,6,0],[0,0,2]])
     status:  optimal
-    optimal value:  24.0
+    maximum product:  24.0
     allocation:
-    agent 0 gets 1.0 of item 0
-    agent 0 gets 1.0 of item 1
-    agent 0 gets 0.0 of item 2
-    agent 1 gets 0.0 of item 0
-    agent 1 gets 0.0 of item 1
-    agent 1 gets 1.0 of item 2
+      agent 0 gets 1.0 of item 0
+      agent 0 gets 1.0 of item 1
+      agent 0 gets 0.0 of item 2
+      agent 1 gets 0.0 of item 0
+      agent 1 gets 0.0 of item 1
+      agent 1 gets 1.0 of item 2
     >>> max_product_2([[6,2,7],[1,5,7]])
     status:  optimal
-    optimal value:  81.0
+    maximum product:  81.0
     allocation:
-    agent 0 gets 1.0 of item 0
-    agent 0 gets 0.0 of item 1
-    agent 0 gets 0.43 of item 2
-    agent 1 gets 0.0 of item 0
-    agent 1 gets 1.0 of item 1
-    agent 1 gets 0.57 of item 2
+      agent 0 gets 1.0 of item 0
+      agent 0 gets 0.0 of item 1
+      agent 0 gets 0.43 of item 2
+      agent 1 gets 0.0 of item 0
+      agent 1 gets 1.0 of item 1
+      agent 1 gets 0.57 of item 2
 
     :param value_matrix: list of lists.
     :return: allocation that maximizes the sum of logs.
     """
+    start = time.perf_counter()
+    objective, constraints, Xig = build_max_product_2(value_matrix, integer)
+    solve_and_print(objective, constraints, Xig, integer, time.perf_counter()-start)
 
-    num_of_agents = len(value_matrix)
-    num_of_items =  len(value_matrix[0])
-    Xig = [[cvxpy.Variable(integer=integer) for _ in range(num_of_items)] for _ in range(num_of_agents)]   # Xig[i][g] represents the fraction of good g given to agent i. Should be in {0,1}.
-
-    Wi = [cvxpy.Variable() for _ in range(num_of_agents)]                                                # Wi[i] represents the log of the value of agent i
-
-    objective = sum(Wi)
-    constraints = feasibility_constraints(Xig)
-    for i in range(num_of_agents):
-        value_of_i = sum([Xig[i][g] * value_matrix[i][g] for g in range(num_of_items)])
-        constraints.append(Wi[i] <= cvxpy.log(value_of_i))
-    solve_and_print(objective, constraints, Xig, integer)
 
 
+def build_max_product_3(value_matrix: list, max_value:int, integer=False):
+    """
+    Build the program of max_product_3: log(value) is approximated from below by the segments between log(k) and log(k+1).
+    :return: objective, constraints, allocation variable.
+    """
+    num_of_agents = len(value_matrix)
+    Xig = allocation_variables(num_of_agents, len(value_matrix[0]), integer)   # Xig[i,g] represents the fraction of good g given to agent i. Should be in {0,1}.
+    Wi = cvxpy.Variable((num_of_agents, 1))                                     # Wi[i] represents the log of the value of agent i
+    k = np.arange(1, max_value+1)
+    slopes = np.log(k+1) - np.log(k)
+    intercepts = np.log(k) - slopes*k
+    values = cvxpy.reshape(agent_values(value_matrix, Xig), (num_of_agents, 1), order="C")
+    constraints = feasibility_constraints(Xig) + [
+        # Wi[i] <= log(k) + (log(k+1)-log(k))*(value_of_i - k) for every k:
+        Wi @ np.ones((1, max_value)) <= np.ones((num_of_agents, 1)) @ intercepts.reshape(1, -1) + values @ slopes.reshape(1, -1)
+    ]
+    return cvxpy.sum(Wi), constraints, Xig
 
 def max_product_3(value_matrix: list, max_value:int, integer=False):
     """
-    >>> max_product_3([[6,2,7],[1,5,7]], 10)
-    Agent #1 gets items #1, #3
-    Agent #2 gets item #2
-    Product = 65
+    >>> max_product_3([[6,2,7],[1,5,7]], 10, integer=True)
+    status:  optimal
+    maximum product:  72.6
+    allocation:
+      agent 0 gets item 0
+      agent 1 gets item 1
+      agent 1 gets item 2
+
     :param value_matrix: list of lists.
     :return: allocation that maximizes the sum of logs.
     """
+    start = time.perf_counter()
+    objective, constraints, Xig = build_max_product_3(value_matrix, max_value, integer)
+    solve_and_print(objective, constraints, Xig, integer, time.perf_counter()-start)
 
-    num_of_agents = len(value_matrix)
-    num_of_items =  len(value_matrix[0])
-    Wi = [cvxpy.Variable() for _ in range(num_of_agents)]                                                # Wi[i] represents the log of the value of agent i
-    Xig = [[cvxpy.Variable(integer=integer) for _ in range(num_of_items)] for _ in range(num_of_agents)]   # Xig[i][g] represents the fraction of good g given to agent i. Should be in {0,1}.
-
-    objective = sum(Wi)
-    constraints = feasibility_constraints(Xig)
-
-    for i in range(num_of_agents):
-        value_of_i = sum([Xig[i][g] * value_matrix[i][g] for g in range(num_of_items)])
-        for k in range(1,max_value+1):
-            constraint_k = Wi[i] <= math.log(k) + (math.log(k+1) - math.log(k))*(value_of_i - k)
-            constraints.append(constraint_k)
-    solve_and_print(objective, constraints, Xig, integer)
 
 
-print("\nFormulation 1:")
-max_product_1([[6, 6, 0], [0, 0, 2]])
-max_product_1([[6, 2, 7], [1, 5, 7]])   # Uri Zitzer's example
+def piecewise_log(values:np.ndarray)->np.ndarray:
+    """
+    The function that max_product_3 maximizes instead of log: it equals log at the positive integers,
+    and is linear between them (and below 1, extends the segment between 1 and 2).
 
-print("\nFormulation 2:")
-max_product_2([[6, 6, 0], [0, 0, 2]])
-max_product_2([[6, 2, 7], [1, 5, 7]])
+    >>> np.round(piecewise_log(np.array([0, 1, 1.5, 2, 10])), 3).tolist()
+    [-0.693, 0.0, 0.347, 0.693, 2.303]
+    """
+    k = np.maximum(np.floor(values), 1)
+    return np.log(k) + (np.log(k+1) - np.log(k)) * (values - k)
 
-print("\nFormulation 3, integers")
-max_product_3([[6, 6, 0], [0, 0, 2]], 10, integer=True)
-max_product_3([[6, 2, 7], [1, 5, 7]], 10, integer=True)
+def max_product_3_adaptive(value_matrix: list, integer=False, tolerance:float=1e-6, max_rounds:int=100):
+    """
+    Solve the program of max_product_3 without the bound max_value, by a cutting-plane loop.
+    The constraint "Wi <= log(k) + (log(k+1)-log(k))*(value_of_i - k)" is needed only for the k nearest to the value of i.
+    So the program starts with geometrically spaced breakpoints k = 1, 2, 4, 8, ..., and after every solve,
+    for every agent whose Wi exceeds the piecewise-linear log of its value, the constraint for k = floor(value) is added,
+    unless it is already in the program.
+    The approximation gap (the objective minus the sum of piecewise-linear logs of the values) is logged every round;
+    when it is at most `tolerance`, the solution is optimal for the program with all breakpoints.
+    The loop also stops when a round adds no new constraint: the remaining gap is then the solver's inaccuracy.
+
+    >>> max_product_3_adaptive([[6,2,7],[1,5,7]], integer=True)
+    status:  optimal
+    maximum product:  72.0
+    allocation:
+      agent 0 gets item 0
+      agent 1 gets item 1
+      agent 1 gets item 2
 
+    :param value_matrix: list of lists.
+    :param tolerance: the approximation gap at which the loop stops; values below SOLVER_TOLERANCE are raised to it.
+    :param max_rounds: the maximum number of solves; if the gap is still above `tolerance`, a warning is logged.
+    :return: allocation that maximizes the sum of logs.
+    :raise ValueError: if a solve fails.
+    """
+    start = time.perf_counter()
+    tolerance = max(tolerance, SOLVER_TOLERANCE)
+    value_matrix = np.array(value_matrix, dtype=float)
+    num_of_agents = len(value_matrix)
+    Xig = allocation_variables(num_of_agents, value_matrix.shape[1], integer)   # Xig[i,g] represents the fraction of good g given to agent i. Should be in {0,1}.
+    Wi = cvxpy.Variable(num_of_agents)                                          # Wi[i] represents the log of the value of agent i
+    values = agent_values(value_matrix, Xig)
+    largest_value = max(value_matrix.sum(axis=1).max(), 1)
+    breakpoints = 2.0 ** np.arange(int(math.log2(largest_value)) + 1)
+    slopes = np.log(breakpoints+1) - np.log(breakpoints)
+    constraints = feasibility_constraints(Xig) + [
+        # Wi[i] <= log(k) + (log(k+1)-log(k))*(value_of_i - k) for every breakpoint k:
+        cvxpy.reshape(Wi, (num_of_agents, 1), order="C") @ np.ones((1, len(breakpoints))) <=
+            np.ones((num_of_agents, 1)) @ (np.log(breakpoints) - slopes*breakpoints).reshape(1, -1)
+            + cvxpy.reshape(values, (num_of_agents, 1), order="C") @ slopes.reshape(1, -1)
+    ]
+    logger.info("build time: %.3f, %d geometric breakpoints", time.perf_counter()-start, len(breakpoints))
+    cuts = {(i, int(k)) for i in range(num_of_agents) for k in breakpoints}   # the pairs (i,k) whose constraint is in the program
+    num_of_cuts = 0
+    for iteration in range(1, max_rounds+1):
+        prob = cvxpy.Problem(cvxpy.Maximize(cvxpy.sum(Wi)), constraints)
+        prob.solve()
+        if prob.status not in ["optimal", "optimal_inaccurate"]:
+            raise ValueError(f"Round {iteration}: solver status is {prob.status}")
+        excess = Wi.value - piecewise_log(values.value)
+        gap = excess.clip(min=0).sum()
+        logger.info("round %d: %d cuts, objective %f, approximation gap %g, solve time %.3f",
+            iteration, num_of_cuts, prob.value, gap, prob.solver_stats.solve_time or 0)
+        if gap <= tolerance:
+            break
+        new_cuts = {(int(i), max(math.floor(values.value[i]), 1)) for i in np.flatnonzero(excess > tolerance / num_of_agents)} - cuts
+        if not new_cuts:
+            logger.info("No new cuts; the approximation gap %g is within the solver's accuracy", gap)
+            break
+        for i,k in sorted(new_cuts):
+            slope = math.log(k+1) - math.log(k)
+            constraints.append(Wi[i] <= math.log(k) + slope*(values[i] - k))
+        cuts |= new_cuts
+        num_of_cuts += len(new_cuts)
+    else:
+        logger.warning("Stopped after %d rounds; the approximation gap is %f", max_rounds, gap)
+    print_solution(prob, Xig, integer)
+
+
+if __name__ == "__main__":
+    import sys
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.INFO)
+
+    print("\nFormulation 1:")
+    max_product_1([[6, 6, 0], [0, 0, 2]])
+    max_product_1([[6, 2, 7], [1, 5, 7]])   # Uri Zitzer's example
+
+    print("\nFormulation 2:")
+    max_product_2([[6, 6, 0], [0, 0, 2]])
+    max_product_2([[6, 2, 7], [1, 5, 7]])
+
+    print("\nFormulation 3, integers")
+    max_product_3([[6, 6, 0], [0, 0, 2]], 10, integer=True)
+    max_product_3([[6, 2, 7], [1, 5, 7]], 10, integer=True)
+
+    print("\nFormulation 3, integers, adaptive breakpoints")
+    max_product_3_adaptive([[6, 2, 7], [1, 5, 7]], integer=True)
+    max_product_3_adaptive(np.random.randint(0, 10**6, (5, 12)), integer=True)
+
+    print("\nFormulation 2, 100 agents and 1000 items:")
+    value_matrix = np.random.randint(1, 100, (100, 1000))
+    value_matrix = value_matrix / value_matrix.sum(axis=1, keepdims=True)   # normalizing does not change the optimal allocation, and helps the solver
+    start = time.perf_counter()
+    objective, constraints, Xig = build_max_product_2(value_matrix)
+    build_time = time.perf_counter() - start
+    prob = cvxpy.Problem(cvxpy.Maximize(objective), constraints)
+    prob.solve(solver=cvxpy.SCS)
+    print("status: {}, build time: {:.3f}, compilation time: {:.3f}, solve time: {:.3f}".format(
+        prob.status, build_time, prob.compilation_time, prob.solver_stats.solve_time or 0))
 
 
 
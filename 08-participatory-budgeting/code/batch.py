@@ -0,0 +1,187 @@
+#!python3
+
+"""
+Run participatory-budgeting rules over many elections in parallel,
+and stream the results to a CSV file.
+
+Each election is a file in a directory. A JSON election file has the arguments of equal_shares:
+    {"N": [voters], "C": [projects], "cost": {project: cost}, "approvers": {project: [voters]}, "B": budget}
+A .pb file is an approval election in the Pabulib format (see pabulib.py).
+
+Usage:
+    python batch.py ELECTIONS_DIRECTORY --rule equal_shares --output results.csv --workers 4
+
+The output file is also the checkpoint: running the same command again skips the elections that already have a row for the rule.
+An election that fails (e.g. a malformed file) gets a row with an "error" field instead of winners, and the batch goes on;
+such rows are not counted as completed, so the election is tried again when the batch is resumed with the same rule.
+"""
+
+import argparse, csv, glob, json, os, sys, time
+from multiprocessing import Pool
+
+from equalshares import equal_shares
+from discrete import proportional_budgeting
+from pabulib import read_pabulib
+
+
+FIELDS = ["election", "rule", "winners", "load_seconds", "compute_seconds", "error"]
+
+
+def load_election(path:str)->dict:
+    """
+    Load an election file into a dict with the arguments of equal_shares: N, C, cost, approvers, B.
+    """
+    if path.endswith(".pb"):
+        return read_pabulib(path)
+    with open(path) as file:
+        election = json.load(file)
+    return {key: election[key] for key in ["N", "C", "cost", "approvers", "B"]}
+
+
+def run_rule(rule:str, election:dict)->list:
+    """
+    Run the given rule on the given election, and return the list of winners.
+
+    >>> election = {"N": [1,2,3], "C": ["x","y","z"], "cost": {"x":100,"y":200,"z":300}, "approvers": {"x":[1],"y":[2],"z":[3]}, "B": 600}
+    >>> run_rule("equal_shares", election)
+    ['x', 'y', 'z']
+    >>> run_rule("proportional_budgeting", election)
+    ['x', 'y']
+    """
+    if rule=="equal_shares":
+        return equal_shares(**election)
+    elif rule=="proportional_budgeting":
+        ballots = {i: set() for i in election["N"]}
+        for c in election["C"]:
+            for i in election["approvers"][c]:
+                ballots[i].add(c)
+        votes = list(ballots.values())
+        return sorted(proportional_budgeting(election["cost"], votes, election["B"]))
+    else:
+        raise ValueError(f"Unknown rule: {rule}")
+
+
+def run_election(path:str, rule:str)->dict:
+    """
+    Load a single election, run the rule on it, and return a result row (see FIELDS).
+    If loading or running fails, return a row with the error, and without winners and compute_seconds.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "bad.json")
+    >>> with open(path, "w") as file:
+    ...     json.dump({"N": [1], "C": ["x"], "cost": {"x": 1}, "B": 1}, file)
+    >>> row = run_election(path, "equal_shares")
+    >>> row["election"], row["winners"], row["compute_seconds"], row["error"]
+    ('bad.json', '', '', "KeyError: 'approvers'")
+    """
+    row = {"election": os.path.basename(path), "rule": rule, "winners": "", "load_seconds": "", "compute_seconds": "", "error": ""}
+    try:
+        start = time.perf_counter()
+        election = load_election(path)
+        loaded = time.perf_counter()
+        row["load_seconds"] = round(loaded - start, 6)
+        winners = run_rule(rule, election)
+        computed = time.perf_counter()
+    except Exception as error:
+        row["error"] = f"{type(error).__name__}: {error}"
+        return row
+    row["winners"] = json.dumps(winners)
+    row["compute_seconds"] = round(computed - loaded, 6)
+    return row
+
+
+def _run_election(args):
+    return run_election(*args)
+
+
+def completed_elections(output_path:str, rule:str)->set:
+    """
+    Read the rows that are already in the output file, and return the pairs (election, rule) of the complete ones.
+    The file is rewritten without the incomplete rows (a crash may leave a partial last row)
+    and without the error rows of the given rule, whose elections are run again.
+    Error rows of other rules are kept. The new file is written beside the old one and then replaces it,
+    so an interruption during the rewrite leaves the old file intact.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "results.csv")
+    >>> with open(path, "w") as file:
+    ...     print(",".join(FIELDS), file=file)
+    ...     print("a.json,equal_shares,[1],0.1,0.2,", file=file)
+    ...     print("bad.json,equal_shares,,0.1,,KeyError: 'approvers'", file=file)
+    ...     print("b.json,proportional_bud", end="", file=file)
+    >>> sorted(completed_elections(path, "proportional_budgeting"))
+    [('a.json', 'equal_shares')]
+    >>> with open(path, newline="") as file:
+    ...     [(row["election"], row["error"]) for row in csv.DictReader(file)]
+    [('a.json', ''), ('bad.json', "KeyError: 'approvers'")]
+    >>> sorted(completed_elections(path, "equal_shares"))
+    [('a.json', 'equal_shares')]
+    >>> with open(path, newline="") as file:
+    ...     [row["election"] for row in csv.DictReader(file)]
+    ['a.json']
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    is_complete = lambda row: row.get("compute_seconds") and not row.get("error")
+    kept = [row for row in rows if is_complete(row) or (row.get("error") and row.get("rule")!=rule)]
+    temporary_path = output_path + ".tmp"
+    with open(temporary_path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(kept)
+    os.replace(temporary_path, output_path)
+    return {(row["election"], row["rule"]) for row in kept if is_complete(row)}
+
+
+def run_batch(paths:list, rule:str, output_path:str, workers:int=None, max_tasks_per_worker:int=100):
+    """
+    Run the rule on all given election files in a process pool, and append a row per election to the output CSV file.
+    Elections that already have a row for this rule in the output file are skipped, so an interrupted batch can be resumed,
+    and the same output file can hold the results of several rules.
+    Only the paths are sent to the workers, and every row is written as soon as it arrives,
+    so memory is bounded by the largest single election per worker.
+    Workers are replaced after max_tasks_per_worker elections.
+    An election that fails does not stop the batch: its row has an "error" field (see run_election).
+
+    :return: a generator of the result rows, in order of completion.
+    """
+    done = completed_elections(output_path, rule)
+    tasks = [(path, rule) for path in paths if (os.path.basename(path), rule) not in done]
+    is_new_file = not os.path.exists(output_path)
+    with open(output_path, "a", newline="") as file, Pool(workers, maxtasksperchild=max_tasks_per_worker) as pool:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        if is_new_file:
+            writer.writeheader()
+        for row in pool.imap_unordered(_run_election, tasks):
+            writer.writerow(row)
+            file.flush()
+            yield row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a participatory-budgeting rule over a directory of elections.")
+    parser.add_argument("directory", help="a directory of election files")
+    parser.add_argument("--rule", default="equal_shares", choices=["equal_shares", "proportional_budgeting"])
+    parser.add_argument("--output", default="results.csv", help="the output CSV file (also used as the checkpoint)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--pattern", default=None, help="a glob pattern of election files in the directory (default: all .json and .pb files)")
+    args = parser.parse_args(argv)
+
+    patterns = [args.pattern] if args.pattern else ["*.json", "*.pb"]
+    paths = sorted(path for pattern in patterns for path in glob.glob(os.path.join(args.directory, pattern)))
+    start = time.perf_counter()
+    count = errors = 0
+    for row in run_batch(paths, args.rule, args.output, args.workers):
+        count += 1
+        if row["error"]:
+            errors += 1
+            print("{}: failed: {}".format(row["election"], row["error"]), flush=True)
+        else:
+            print("{}: {:.3f}s load, {:.3f}s compute".format(row["election"], row["load_seconds"], row["compute_seconds"]), flush=True)
+    print("{} elections in {:.3f}s, {} failed".format(count, time.perf_counter() - start, errors))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -3,33 +3,83 @@ Code from the official website of the Method of Equal Shares:
 https://equalshares.net/implementation/computation
 """
 
+import heapq, itertools, json, math, operator
+from fractions import Fraction
 import numpy as np
+import scipy.sparse
 
-def equal_shares(N, C, cost, approvers, B):
+def equal_shares(N, C, cost, approvers, B, engine="sorted", completion="add1", return_evaluations=False, trace=None, return_exact_rounds=False):
     """
     * Approval ballots,
     * Breaking ties In favor of lower cost, then higher vote count.
     * Completion method: Repeated increase of voter budgets by 1 currency unit (Add1)
     * Use floating point numbers (faster to compute, recommended for testing)
+
+    :param engine: the engine used for each run of equal_shares_fixed_budget ("sorted", "heap" or "exact").
+    :param completion: "add1" tries the increased budgets one by one (see add1_completion);
+                       "search" gallops and binary-searches over them (see add1_completion_search).
+    :param return_evaluations: if True, return a pair (winners, number of runs of equal_shares_fixed_budget).
+    :param trace: an optional callable that receives a record of every round of every run (see equal_shares_fixed_budget).
+    :param return_exact_rounds: if True, also return the number of rounds, over all runs, that were decided exactly
+                                (see equal_shares_fixed_budget_exact; always 0 for the float engines).
+
+    >>> N, C, cost = ["a","b","c"], ["x","y","z"], {"x":100,"y":200,"z":300}
+    >>> approvers = {"x":["a"],"y":["b"],"z":["c"]}
+    >>> equal_shares(N, C, cost, approvers, B=600)
+    ['x', 'y', 'z']
+    >>> equal_shares(N, C, cost, approvers, B=600, return_evaluations=True)
+    (['x', 'y', 'z'], 101)
+    >>> equal_shares(N, C, cost, approvers, B=600, engine="heap", completion="search", return_evaluations=True)
+    (['x', 'y', 'z'], 15)
+    >>> equal_shares(N, C, cost, approvers, B=600, engine="exact", completion="search", return_evaluations=True, return_exact_rounds=True)
+    (['x', 'y', 'z'], 15, 21)
+    """
+    exact_rounds = 0
+    if return_exact_rounds:
+        user_trace = trace
+        def trace(record):
+            nonlocal exact_rounds
+            exact_rounds += record.get("exact", False)
+            if user_trace is not None:
+                user_trace(record)
+    if completion=="add1":
+        mes, evaluations = add1_completion(N, C, cost, approvers, B, engine, trace)
+    elif completion=="search":
+        mes, evaluations = add1_completion_search(N, C, cost, approvers, B, engine, trace)
+    else:
+        raise ValueError(f"Unknown completion: {completion}")
+    result = (mes,) + ((evaluations,) if return_evaluations else ()) + ((exact_rounds,) if return_exact_rounds else ())
+    return result if len(result) > 1 else mes
+
+def is_exhaustive(C, cost, mes, B):
+    """
+    Is the given outcome exhaustive, that is, no other candidate fits in the remaining budget?
+    """
+    current_cost = sum(cost[c] for c in mes)
+    for extra in C:
+        if extra not in mes and current_cost + cost[extra] <= B:
+            return False
+    return True
+
+def add1_completion(N, C, cost, approvers, B, engine="sorted", trace=None):
+    """
+    Run MES with budget B, then with per-voter budgets increased by 1 currency unit at a time,
+    as long as the outcome is not exhaustive and the next outcome still costs at most B.
+
+    :return: a pair (winners, number of runs of equal_shares_fixed_budget).
     """
-    mes = equal_shares_fixed_budget(N, C, cost, approvers, B)
-    # add1 completion
+    mes = equal_shares_fixed_budget(N, C, cost, approvers, B, engine, trace)
+    evaluations = 1
     # start with integral per-voter budget
     budget = int(B / len(N)) * len(N)
-    current_cost = sum(cost[c] for c in mes)
     while True:
-        # is current outcome exhaustive?
-        is_exhaustive = True
-        for extra in C:
-            if extra not in mes and current_cost + cost[extra] <= B:
-                is_exhaustive = False
-                break
-        # if so, stop
-        if is_exhaustive:
+        # is current outcome exhaustive? if so, stop
+        if is_exhaustive(C, cost, mes, B):
             break
         # would the next highest budget work?
         next_budget = budget + len(N)
-        next_mes = equal_shares_fixed_budget(N, C, cost, approvers, next_budget)
+        next_mes = equal_shares_fixed_budget(N, C, cost, approvers, next_budget, engine, trace)
+        evaluations += 1
         current_cost = sum(cost[c] for c in next_mes)
         if current_cost <= B:
             # yes, so continue with that budget
@@ -38,7 +88,68 @@ def equal_shares(N, C, cost, approvers, B):
         else:
             # no, so stop
             break
-    return mes
+    return mes, evaluations
+
+def add1_completion_search(N, C, cost, approvers, B, engine="sorted", trace=None):
+    """
+    Like add1_completion, but finds the last budget increment by galloping and binary search, with far fewer runs of MES.
+    * Usually the same outcome as add1_completion; it may differ when the cost of the outcome is not monotone in the budget
+      between two probed budgets, so use add1_completion when the exact Add1 outcome must be guaranteed.
+
+    :return: a pair (winners, number of runs of equal_shares_fixed_budget).
+    """
+    n = len(N)
+    base_budget = int(B / n) * n
+    fundable = {c for c in C if cost[c] > 0 and len(approvers[c]) > 0}
+    # Step t runs MES with total budget (int(B/n)+t)*n. When the cost of the outcome is monotone in the budget,
+    # the steps that Add1 passes form a prefix, so the last one can be found by a search.
+    outcomes = {}   # map a step to its outcome; step 0 is MES with the original budget B.
+    def outcome(step):
+        if step not in outcomes:
+            step_budget = B if step==0 else base_budget + step * n
+            mes = equal_shares_fixed_budget(N, C, cost, approvers, step_budget, engine, trace)
+            outcomes[step] = (mes, sum(cost[c] for c in mes))
+        return outcomes[step]
+    def is_final(step):
+        # Add1 never continues beyond an exhaustive outcome. An outcome that funds every fundable candidate
+        # cannot change any more, so it is final too.
+        mes = outcome(step)[0]
+        return is_exhaustive(C, cost, mes, B) or fundable <= set(mes)
+    def is_passed(step):
+        # does Add1 reach this step and continue beyond it (assuming it reaches it)?
+        return outcome(step)[1] <= B and not is_final(step)
+    def is_monotone(steps):
+        # are the costs of the outcomes of the given steps (except step 0) non-decreasing?
+        costs = [outcome(step)[1] for step in sorted(steps) if step >= 1]
+        return all(costs[k] <= costs[k+1] for k in range(len(costs)-1))
+    def last_step(first_step):
+        # Scan step by step from a step that Add1 reaches, like add1_completion.
+        step = first_step
+        while not is_final(step) and outcome(step+1)[1] <= B:
+            step += 1
+        return step
+
+    if is_final(0):
+        return outcome(0)[0], len(outcomes)
+    # gallop: find a passed step lo and a non-passed step hi > lo.
+    lo, hi = 0, 1
+    while is_passed(hi) and is_monotone(outcomes):
+        lo, hi = hi, 2*hi
+    # binary search for the first non-passed step in (lo, hi].
+    while hi - lo > 1 and is_monotone(outcomes):
+        mid = (lo + hi) // 2
+        if is_passed(mid):
+            lo = mid
+        else:
+            hi = mid
+    if not is_monotone(outcomes):
+        # the probed costs are not monotone, so the search may be wrong; scan the last bracket like add1_completion.
+        step = last_step(lo)
+    elif outcome(hi)[1] <= B:
+        step = hi      # Add1 reaches hi and stops there, since it is final.
+    else:
+        step = lo      # Add1 stops at lo, since hi costs too much.
+    return outcome(step)[0], len(outcomes)
 
 def break_ties(N, C, cost, approvers, choices):
     remaining = choices.copy()
@@ -48,8 +159,43 @@ def break_ties(N, C, cost, approvers, choices):
     remaining = [c for c in remaining if len(approvers[c]) == best_count]
     return remaining
 
-def equal_shares_fixed_budget(N, C, cost, approvers, B):
-    print("\n  MES WITH BUDGET= ", B)
+def equal_shares_fixed_budget(N, C, cost, approvers, B, engine="sorted", trace=None, return_exact_rounds=False):
+    """
+    Method of Equal Shares with a fixed total budget B, without completion.
+
+    :param engine: "sorted" re-sorts the remaining candidates, and the approvers of each examined candidate, in every round.
+                   "heap" keeps the remaining candidates in a lazy max-heap, and repairs the approver orderings incrementally
+                   (see equal_shares_fixed_budget_heap). Both engines return the same winners.
+                   "exact" returns the outcome of exact rational arithmetic (see equal_shares_fixed_budget_exact).
+    :param trace: an optional callable. If given, it is called at the end of every round with a dict record:
+                  the total budget "B", the "round" number, the "chosen" project, its "eff_vote_count",
+                  and the total "money_left" of the voters after charging. If None, no record is built.
+    :param return_exact_rounds: if True, return a pair (winners, number of rounds that were decided exactly);
+                                the number is always 0 for the float engines.
+
+    >>> N, C, cost = [1,2,3], ["x","y","z"], {"x":100,"y":200,"z":300}
+    >>> approvers = {"x":[1],"y":[2],"z":[3]}
+    >>> equal_shares_fixed_budget(N, C, cost, approvers, B=600)
+    ['x', 'y']
+    >>> equal_shares_fixed_budget(N, C, cost, approvers, B=600, trace=print)
+    {'B': 600, 'round': 1, 'chosen': 'x', 'eff_vote_count': 1.0, 'money_left': 500.0}
+    {'B': 600, 'round': 2, 'chosen': 'y', 'eff_vote_count': 1.0, 'money_left': 300.0}
+    ['x', 'y']
+    >>> approvers = {"x":[1,2,3],"y":[1,2],"z":[3]}
+    >>> equal_shares_fixed_budget(N, C, cost, approvers, B=600, engine="heap", trace=print)
+    {'B': 600, 'round': 1, 'chosen': 'x', 'eff_vote_count': 3.0, 'money_left': 500.0}
+    {'B': 600, 'round': 2, 'chosen': 'y', 'eff_vote_count': 2.0, 'money_left': 300.0}
+    ['x', 'y']
+    """
+    if engine=="exact":
+        winners, exact_rounds = equal_shares_fixed_budget_exact(N, C, cost, approvers, B, trace)
+        return (winners, exact_rounds) if return_exact_rounds else winners
+    elif return_exact_rounds:
+        return equal_shares_fixed_budget(N, C, cost, approvers, B, engine, trace), 0
+    elif engine=="heap":
+        return equal_shares_fixed_budget_heap(N, C, cost, approvers, B, trace)
+    elif engine!="sorted":
+        raise ValueError(f"Unknown engine: {engine}")
     budget = {i: B / len(N) for i in N}
     remaining = {} # map a remaining candidate to previous effective vote count
     for c in C:
@@ -57,7 +203,6 @@ def equal_shares_fixed_budget(N, C, cost, approvers, B):
             remaining[c] = len(approvers[c])       # effective vote count for candidate c
     winners = []
     while True:
-        print("\n  Budgets: ", budget)
         best = []
         best_eff_vote_count = 0
         # go through remaining candidates in order of decreasing previous effective vote count
@@ -93,7 +238,6 @@ def equal_shares_fixed_budget(N, C, cost, approvers, B):
                     elif eff_vote_count == best_eff_vote_count:
                         best.append(c)
                     break
-        print("  Best projects: ", best)
         if not best:
             # no remaining candidates are affordable
             break
@@ -101,7 +245,6 @@ def equal_shares_fixed_budget(N, C, cost, approvers, B):
         if len(best) > 1:
             best.sort()
         best = best[0]
-        print("  Best best project: ", best)
         winners.append(best)
         del remaining[best]
         # charge the approvers of best
@@ -111,10 +254,439 @@ def equal_shares_fixed_budget(N, C, cost, approvers, B):
                 budget[i] -= best_max_payment
             else:
                 budget[i] = 0
+        if trace is not None:
+            trace({"B": B, "round": len(winners), "chosen": best, "eff_vote_count": best_eff_vote_count, "money_left": sum(budget.values())})
+    return winners
+
+def equal_shares_fixed_budget_heap(N, C, cost, approvers, B, trace=None, tolerance=1e-9):
+    """
+    Same as equal_shares_fixed_budget, but faster on large elections:
+    * The remaining candidates are kept in a max-heap keyed by their previous effective vote count.
+    * The money behind every candidate is kept as a running total, updated from the charged voters only.
+    * The approvers of every candidate are kept sorted by budget, and repaired incrementally.
+
+    :param tolerance: a running total within this margin (relative to B) of the cost is recomputed from the budgets.
+    """
+    voters_of_candidate = approvers_to_matrix(N, C, approvers)   # voters x candidates, in CSC format
+    candidates_of_voter = voters_of_candidate.tocsr()
+    budget = np.full(len(N), B / len(N))
+    money_behind = candidates_of_voter.T @ budget
+    margin = tolerance * B
+    heap = []                # entries are (-previous effective vote count, position in C, candidate)
+    sorted_approvers = {}    # map a remaining candidate to its approvers (voter indices), sorted by budget at its last examination
+    last_sorted = {}         # map a remaining candidate to the round in which its approvers were last sorted
+    last_charged = np.zeros(len(N), dtype=int)   # map a voter index to the last round in which the voter was charged
+    for position,c in enumerate(C):
+        if cost[c] > 0 and len(approvers[c]) > 0:
+            heap.append((-len(approvers[c]), position, c))    # effective vote count for candidate c
+            # all budgets are equal, so the given order is sorted
+            sorted_approvers[c] = voters_of_candidate.indices[voters_of_candidate.indptr[position]:voters_of_candidate.indptr[position+1]]
+            last_sorted[c] = 0
+    heapq.heapify(heap)
+    winners = []
+    current_round = 0
+    while True:
+        best = []
+        best_eff_vote_count = 0
+        examined = []   # candidates popped in this round, to be pushed back with their new effective vote count
+        # go through remaining candidates in order of decreasing previous effective vote count;
+        # the previous count is an upper bound on the current one, so the others are left in the heap.
+        while heap and -heap[0][0] >= best_eff_vote_count:
+            (minus_previous_eff_vote_count, position, c) = heapq.heappop(heap)
+            if money_behind[position] < cost[c] + margin:
+                if money_behind[position] < cost[c] - margin:
+                    # c is not affordable, and will never be affordable again; do not push it back.
+                    continue
+                # too close to decide with the running total; recompute it
+                money_behind[position] = sum(budget[sorted_approvers[c]].tolist())
+                if money_behind[position] < cost[c]:
+                    continue
+            # repair the order of the approvers of c
+            order = sorted_approvers[c]
+            charged = last_charged[order] > last_sorted[c]
+            if charged.any():
+                uncharged_voters, charged_voters = order[~charged], order[charged]
+                charged_budgets = budget[charged_voters]
+                if (charged_budgets[1:] < charged_budgets[:-1]).any():   # voters that were charged in the same rounds are still sorted
+                    charged_voters = charged_voters[np.argsort(charged_budgets)]
+                    charged_budgets = budget[charged_voters]
+                # the budgets of the uncharged voters did not change, so they are still sorted; merge the charged voters into them by a binary search
+                slots = np.searchsorted(budget[uncharged_voters], charged_budgets, side="right") + np.arange(len(charged_voters))
+                order = np.empty_like(order)
+                order[slots] = charged_voters
+                charged[:] = True
+                charged[slots] = False
+                order[charged] = uncharged_voters
+                sorted_approvers[c] = order
+            last_sorted[c] = current_round
+            # calculate the new effective vote count of c
+            eff_vote_count = effective_vote_count(cost[c], budget[order])
+            if eff_vote_count is None:
+                # rounding errors: the money behind c covers its cost, but no payment is affordable to all
+                eff_vote_count = -minus_previous_eff_vote_count
+            elif eff_vote_count > best_eff_vote_count:
+                best_eff_vote_count = eff_vote_count
+                best = [c]
+            elif eff_vote_count == best_eff_vote_count:
+                best.append(c)
+            examined.append((-eff_vote_count, position, c))
+        if not best:
+            # no remaining candidates are affordable
+            break
+        best = break_ties(N, C, cost, approvers, best)
+        if len(best) > 1:
+            best.sort()
+        best = best[0]
+        winners.append(best)
+        for entry in examined:
+            if entry[2] != best:
+                heapq.heappush(heap, entry)
+        approvers_of_best = sorted_approvers.pop(best)
+        del last_sorted[best]
+        # charge the approvers of best
+        best_max_payment = cost[best] / best_eff_vote_count
+        current_round += 1
+        old_budgets = budget[approvers_of_best]
+        new_budgets = np.where(old_budgets > best_max_payment, old_budgets - best_max_payment, 0)
+        budget[approvers_of_best] = new_budgets
+        last_charged[approvers_of_best[old_budgets > 0]] = current_round
+        # only the candidates that share approvers with best are touched
+        money_behind -= candidates_of_voter[approvers_of_best].T @ (old_budgets - new_budgets)
+        if trace is not None:
+            trace({"B": B, "round": len(winners), "chosen": best, "eff_vote_count": best_eff_vote_count, "money_left": float(budget.sum())})
     return winners
 
-def equal_shares_budget_aggregation(votes:list[list[float]], minima:list):
-    print("votes: ",votes)
+def approvers_to_matrix(N, C, approvers):
+    """
+    Convert approval ballots from the dict API to a voter x project incidence matrix:
+    row i corresponds to voter N[i], column j to candidate C[j].
+
+    >>> approvers_to_matrix(["a","b","c"], ["x","y"], {"x":["a","c"], "y":["b"]}).toarray()
+    array([[1., 0.],
+           [0., 1.],
+           [1., 0.]])
+    """
+    map_voter_to_row = {i: row for row,i in enumerate(N)}
+    indptr = np.zeros(len(C)+1, dtype=np.int64)
+    np.cumsum([len(approvers[c]) for c in C], out=indptr[1:])
+    rows = np.fromiter(map(map_voter_to_row.__getitem__, itertools.chain.from_iterable(approvers[c] for c in C)), dtype=np.int64, count=indptr[-1])
+    return scipy.sparse.csc_matrix((np.ones(len(rows)), rows, indptr), shape=(len(N), len(C)))
+
+def repeated_subtraction(budgets:np.ndarray, payment:float, times:int)->np.ndarray:
+    """
+    The budgets after `times` subtractions of the same payment, with the same float64 result as subtracting in a loop
+    (assuming the budgets stay above the payment).
+
+    >>> budgets = np.array([1000/3, 2.5, 7.0])
+    >>> expected = budgets.copy()
+    >>> for _ in range(1000):
+    ...     expected = expected - 1/500
+    >>> bool((repeated_subtraction(budgets, 1/500, 1000) == expected).all())
+    True
+    """
+    # All floats in a binade [2^(e-1), 2^e) are multiples of its ulp, so while a budget stays in its binade,
+    # subtracting the payment is the same as subtracting the payment rounded to a multiple of the ulp (unless the rounding is a tie).
+    # These subtractions are done at once; the others are done one by one, and there are few of them, as each one leaves a binade.
+    budgets = np.array(budgets, dtype=np.float64)
+    remaining = np.full(len(budgets), times, dtype=np.int64)
+    while True:
+        active = np.flatnonzero(remaining > 0)
+        if len(active)==0:
+            return budgets
+        x = budgets[active]
+        _, exponent = np.frexp(x)                            # 2^(exponent-1) <= x < 2^exponent
+        ulp = np.ldexp(1.0, exponent - 53)
+        payment_in_ulps = payment / ulp                       # exact, as ulp is a power of 2
+        rounded = np.rint(payment_in_ulps)
+        excess = payment_in_ulps - rounded
+        above_binade = (x - np.ldexp(0.5, exponent)) / ulp   # an exact integer
+        # subtraction number s stays in the binade iff above_binade - s*rounded >= excess
+        limit = above_binade - (excess > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            in_binade = np.where(rounded > 0, np.floor(limit / np.maximum(rounded, 1)), np.where(limit >= 0, np.inf, 0))
+        in_binade = np.where(np.abs(excess) == 0.5, 0, np.clip(in_binade, 0, None))
+        at_once = np.minimum(in_binade, remaining[active]).astype(np.int64)
+        x = x - (at_once * rounded) * ulp
+        left = remaining[active] - at_once
+        one_by_one = left > 0
+        x[one_by_one] = x[one_by_one] - payment
+        budgets[active] = x
+        remaining[active] = left - one_by_one
+
+def effective_vote_count(cost, budgets):
+    """
+    Effective vote count of a candidate with the given cost, whose approvers have the given budgets
+    sorted in increasing order: the approvers that cannot afford an equal share of the remaining cost
+    pay their entire budget, and the others pay equally.
+    Computed with the same arithmetic as the loop in equal_shares_fixed_budget.
+
+    :return: the effective vote count, or None if the approvers cannot afford the candidate.
+
+    >>> effective_vote_count(30, np.array([10., 10., 10.]))
+    3.0
+    >>> effective_vote_count(30, np.array([5., 20., 20.]))
+    2.4
+    >>> effective_vote_count(30, np.array([5., 5., 5.])) is None
+    True
+    """
+    k = len(budgets)
+    paid_so_far = np.zeros(k)
+    np.cumsum(budgets[:-1], out=paid_so_far[1:])
+    max_payments = (cost - paid_so_far) / np.arange(k, 0, -1)
+    affordable = np.flatnonzero(max_payments <= budgets)
+    if len(affordable)==0:
+        return None
+    return float(cost / max_payments[affordable[0]])
+
+ROUNDING_ERROR = 2.0**-50   # a generous bound on the relative rounding error of a single float operation
+
+def equal_shares_fixed_budget_exact(N, C, cost, approvers, B, trace=None):
+    """
+    Same as equal_shares_fixed_budget, but the outcome is exact: the same as if all numbers were fractions.Fraction.
+    * The rounds are computed with float budgets, and every voter has a bound on the error of its float budget.
+    * A round in which some comparison falls within the error bounds (an affordability test, a payment test,
+      or a near-tie between effective vote counts) is decided exactly: the budgets are brought up to date
+      by replaying the previous rounds with fractions, the round is computed with fractions, and the floats are reset.
+
+    :param trace: as in equal_shares_fixed_budget; every record also says whether its round was decided "exact"ly.
+    :return: a pair (winners, number of rounds that were decided exactly).
+
+    After b is funded, each voter has exactly 1 left, so d is affordable; with floats, voter 3 has slightly less than 1:
+    >>> N, C, cost = [1,2,3], ["a","b","c","d"], {"a":10,"b":10,"c":7,"d":1}
+    >>> approvers = {"a":[1,3], "b":[1,2,3], "c":[2,3], "d":[3]}
+    >>> equal_shares_fixed_budget(N, C, cost, approvers, B=13)
+    ['b']
+    >>> equal_shares_fixed_budget_exact(N, C, cost, approvers, B=13)
+    (['b', 'd'], 1)
+    >>> equal_shares_fixed_budget(N, C, cost, approvers, B=13, engine="exact", return_exact_rounds=True)
+    (['b', 'd'], 1)
+    """
+    class Undecided(Exception):
+        # some comparison of this round is within the error bounds
+        pass
+
+    def float_eff_vote_count(c):
+        # the effective vote count of c and a bound on its error, or None if c is surely not affordable.
+        approvers[c].sort(key=budget.__getitem__)
+        get = operator.itemgetter(*approvers[c], approvers[c][0])   # an extra item, so that a tuple is returned even for a single approver
+        budgets, errors = get(budget)[:-1], get(error)[:-1]
+        money_behind_now = sum(budgets)
+        money_error = sum(errors) + len(budgets) * ROUNDING_ERROR * money_behind_now
+        if money_behind_now < cost[c] - money_error:
+            return None
+        if money_behind_now <= cost[c] + money_error:
+            raise Undecided
+        paid_so_far = paid_error = 0
+        denominator = len(budgets)
+        for budget_of_i, error_of_i in zip(budgets, errors):
+            max_payment = (cost[c] - paid_so_far) / denominator
+            payment_error = paid_error / denominator + 2 * ROUNDING_ERROR * max_payment
+            if abs(max_payment - budget_of_i) <= payment_error + error_of_i:
+                raise Undecided
+            if max_payment > budget_of_i:
+                paid_so_far += budget_of_i
+                paid_error += error_of_i + ROUNDING_ERROR * paid_so_far
+                denominator -= 1
+            else:
+                eff_vote_count = cost[c] / max_payment
+                return eff_vote_count, eff_vote_count * (payment_error / max_payment + 2 * ROUNDING_ERROR)
+        raise Undecided   # the floats say that c is affordable, but no payment is affordable to all
+
+    def exact_eff_vote_count(c):
+        # the effective vote count of c with the exact budgets, or None if it is not affordable.
+        cost_of_c = Fraction(cost[c])
+        paid_so_far = 0
+        denominator = len(approvers[c])
+        for budget_of_i in sorted(exact_budget[i] for i in approvers[c]):
+            max_payment = (cost_of_c - paid_so_far) / denominator
+            if max_payment > budget_of_i:
+                paid_so_far += budget_of_i
+                denominator -= 1
+            else:
+                return cost_of_c / max_payment
+        return None
+
+    def charge_exactly(c, eff_vote_count):
+        max_payment = Fraction(cost[c]) / eff_vote_count
+        for i in approvers[c]:
+            exact_budget[i] = exact_budget[i] - max_payment if exact_budget[i] > max_payment else Fraction(0)
+            budget[i] = float(exact_budget[i])
+            error[i] = ROUNDING_ERROR * budget[i]
+
+    def float_round():
+        # the winner of the round, its effective vote count and the error bound, all decided with floats (or raise Undecided).
+        best = []
+        best_eff_vote_count = best_error = 0
+        for c in sorted(remaining, key=lambda c: remaining[c][0], reverse=True):
+            (previous_eff_vote_count, previous_error) = remaining[c]
+            if previous_eff_vote_count + previous_error < best_eff_vote_count - best_error:
+                break   # c cannot be better than the best so far
+            result = float_eff_vote_count(c)
+            if result is None:
+                del remaining[c]   # c is not affordable
+                continue
+            remaining[c] = (eff_vote_count, eff_error) = result
+            if best and abs(eff_vote_count - best_eff_vote_count) <= eff_error + best_error:
+                raise Undecided    # a near-tie
+            if eff_vote_count > best_eff_vote_count:
+                best, best_eff_vote_count, best_error = [c], eff_vote_count, eff_error
+        if not best:
+            return None
+        best = best[0]
+        payment = cost[best] / best_eff_vote_count
+        payment_error = payment * (best_error / best_eff_vote_count + 2 * ROUNDING_ERROR)
+        if any(abs(budget[i] - payment) <= error[i] + payment_error for i in approvers[best]):
+            raise Undecided
+        return best, best_eff_vote_count, payment, payment_error
+
+    def exact_round():
+        # the winner of the round and its effective vote count, decided with fractions.
+        best = []
+        best_eff_vote_count = 0
+        for c in sorted(remaining, key=lambda c: remaining[c][0], reverse=True):
+            (previous_eff_vote_count, previous_error) = remaining[c]
+            if previous_eff_vote_count + previous_error < best_eff_vote_count:
+                break   # c cannot be better than the best so far
+            eff_vote_count = exact_eff_vote_count(c)
+            if eff_vote_count is None:
+                del remaining[c]   # c is not affordable
+                continue
+            remaining[c] = (float(eff_vote_count), ROUNDING_ERROR * float(eff_vote_count))
+            if eff_vote_count > best_eff_vote_count:
+                best_eff_vote_count = eff_vote_count
+                best = [c]
+            elif eff_vote_count == best_eff_vote_count:
+                best.append(c)
+        if not best:
+            return None
+        best = break_ties(N, C, cost, approvers, best)
+        if len(best) > 1:
+            best.sort()
+        return best[0], best_eff_vote_count
+
+    budget = {i: B / len(N) for i in N}
+    error = {i: ROUNDING_ERROR * budget[i] for i in N}
+    exact_budget = None   # the exact budgets after the first `replayed` rounds, created at the first exact round
+    replayed = 0
+    remaining = {} # map a remaining candidate to previous effective vote count (as a float) and a bound on its error
+    for c in C:
+        if cost[c] > 0 and len(approvers[c]) > 0:
+            remaining[c] = (len(approvers[c]), 0)
+    winners = []
+    exact_rounds = 0
+    while True:
+        try:
+            result = float_round()
+            decided_exactly = False
+        except Undecided:
+            decided_exactly = True
+        if decided_exactly:
+            # bring the exact budgets up to date: the rounds since the last exact round were decided correctly with floats
+            if exact_budget is None:
+                exact_budget = {i: Fraction(B) / len(N) for i in N}
+            for c in winners[replayed:]:
+                charge_exactly(c, exact_eff_vote_count(c))
+            result = exact_round()
+            exact_rounds += 1
+        if result is None:
+            # no remaining candidates are affordable
+            break
+        best = result[0]
+        winners.append(best)
+        del remaining[best]
+        if decided_exactly:
+            best_eff_vote_count = result[1]
+            charge_exactly(best, best_eff_vote_count)
+            replayed = len(winners)
+        else:
+            (best, best_eff_vote_count, payment, payment_error) = result
+            for i in approvers[best]:
+                if budget[i] > payment:
+                    budget[i] -= payment
+                    error[i] += payment_error + ROUNDING_ERROR * budget[i]
+                else:
+                    budget[i] = error[i] = 0
+        if trace is not None:
+            trace({"B": B, "round": len(winners), "chosen": best, "eff_vote_count": float(best_eff_vote_count),
+                   "money_left": sum(budget.values()), "exact": decided_exactly})
+    return winners, exact_rounds
+
+def equal_shares_fixed_budget_sparse(approval_matrix, cost_vector, B, C=None, trace=None):
+    """
+    Same as equal_shares_fixed_budget, for ballots given as a sparse voter x project incidence matrix
+    (see approvers_to_matrix) and costs given as a vector.
+    The budgets are kept in a float64 vector; in every round, the money behind all projects is computed by one
+    sparse segment sum, and the effective vote counts and the charging are vectorized per project.
+
+    :param approval_matrix: a scipy.sparse matrix with a row per voter and a column per project; nonzero means approval.
+    :param cost_vector: the cost of each project (one per column).
+    :param C: optional project names (one per column). They are used for the final tie-breaking, like the dict API, and are returned as winners.
+    :param trace: an optional callable that receives a record of every round (see equal_shares_fixed_budget).
+    :return: the list of winners: names from C if given, otherwise column indices.
+
+    >>> approval_matrix = approvers_to_matrix([1,2,3], ["x","y","z"], {"x":[1,2,3],"y":[1,2],"z":[3]})
+    >>> equal_shares_fixed_budget_sparse(approval_matrix, [100,200,300], 600, C=["x","y","z"], trace=print)
+    {'B': 600, 'round': 1, 'chosen': 'x', 'eff_vote_count': 3.0, 'money_left': 500.0}
+    {'B': 600, 'round': 2, 'chosen': 'y', 'eff_vote_count': 2.0, 'money_left': 300.0}
+    ['x', 'y']
+    >>> equal_shares_fixed_budget_sparse(approval_matrix, [100,200,300], 600)
+    [0, 1]
+    """
+    approval_matrix = scipy.sparse.csc_matrix(approval_matrix, dtype=np.float64, copy=True)
+    approval_matrix.sum_duplicates()
+    approval_matrix.eliminate_zeros()
+    approval_matrix.data[:] = 1
+    indptr, indices = approval_matrix.indptr, approval_matrix.indices
+    num_voters, num_projects = approval_matrix.shape
+    cost = np.asarray(cost_vector, dtype=np.float64)
+    num_approvers = np.diff(indptr)
+    names = list(C) if C is not None else list(range(num_projects))
+    budget = np.full(num_voters, B / num_voters)
+    remaining = {} # map a remaining candidate to previous effective vote count
+    for c in range(num_projects):
+        if cost[c] > 0 and num_approvers[c] > 0:
+            remaining[c] = num_approvers[c]
+    winners = []
+    while True:
+        money_behind_now = approval_matrix.T @ budget
+        for c in [c for c in remaining if money_behind_now[c] < cost[c]]:
+            del remaining[c]   # c is not affordable, and will never be affordable again
+        best = []
+        best_eff_vote_count = 0
+        # go through remaining candidates in order of decreasing previous effective vote count
+        for c in sorted(remaining, key=lambda c: remaining[c], reverse=True):
+            if remaining[c] < best_eff_vote_count:
+                # c cannot be better than the best so far
+                break
+            eff_vote_count = effective_vote_count(cost[c], np.sort(budget[indices[indptr[c]:indptr[c+1]]]))
+            if eff_vote_count is None:
+                continue
+            remaining[c] = eff_vote_count
+            if eff_vote_count > best_eff_vote_count:
+                best_eff_vote_count = eff_vote_count
+                best = [c]
+            elif eff_vote_count == best_eff_vote_count:
+                best.append(c)
+        if not best:
+            # no remaining candidates are affordable
+            break
+        # break ties in favor of lower cost, then higher vote count, then name
+        best_cost = min(cost[c] for c in best)
+        best = [c for c in best if cost[c] == best_cost]
+        best_count = max(num_approvers[c] for c in best)
+        best = [c for c in best if num_approvers[c] == best_count]
+        best = min(best, key=lambda c: names[c])
+        winners.append(names[best])
+        del remaining[best]
+        # charge the approvers of best
+        best_max_payment = cost[best] / best_eff_vote_count
+        approvers_of_best = indices[indptr[best]:indptr[best+1]]
+        budget[approvers_of_best] = np.where(budget[approvers_of_best] > best_max_payment, budget[approvers_of_best] - best_max_payment, 0)
+        if trace is not None:
+            trace({"B": B, "round": len(winners), "chosen": names[best], "eff_vote_count": best_eff_vote_count, "money_left": float(budget.sum())})
+    return winners
+
+def equal_shares_budget_aggregation(votes:list[list[float]], minima:list, trace=None):
     num_voters = len(votes)
     N = list(range(num_voters))        # voters
 
@@ -134,7 +706,7 @@ def equal_shares_budget_aggregation(votes:list[list[float]], minima:list):
             cost[candidate_name]=min_per_issue if part==min_per_issue else 1
             approvers[candidate_name] = [i for i in range(num_voters) if votes[i][issue] >= part]
 
-    funded_candidates = equal_shares_fixed_budget(N, C, cost, approvers, total_budget)
+    funded_candidates = equal_shares_fixed_budget(N, C, cost, approvers, total_budget, trace=trace)
 
     budget = {}
     for issue in range(num_issues):
@@ -145,6 +717,158 @@ def equal_shares_budget_aggregation(votes:list[list[float]], minima:list):
 
 
 
+def equal_shares_budget_aggregation_compact(votes:list[list[float]], minima:list, trace=None)->dict:
+    """
+    Same as equal_shares_budget_aggregation, without building a candidate for every unit of every issue:
+    * Each issue has at most two live candidates: its minimum unit, and its lowest unfunded later unit.
+    * A run of consecutive units that win with the same effective vote count is funded in one round.
+
+    :param trace: an optional callable that receives a record of every round (see equal_shares_fixed_budget);
+                  "chosen" is the last unit of the run, and "units" is the length of the run.
+    :return: a dict that maps each issue to its highest funded unit (0 if none), as an int.
+
+    >>> votes = [[2,18], [2,18], [10,10], [12,0]]
+    >>> equal_shares_budget_aggregation_compact(votes, minima=[2,10])
+    {0: 7, 1: 12}
+    >>> equal_shares_budget_aggregation(votes, minima=[2,10])
+    {0: '0-07', 1: '1-12'}
+    """
+    # The approvers of unit `part` of an issue are the voters whose vote for it is at least `part`: a prefix of the voters sorted by vote.
+    # Among the later units of an issue (which cost 1), the lowest unfunded one has a superset of the approvers of the others,
+    # so it always wins over them (and ties are broken in its favor).
+    votes = np.asarray(votes)
+    num_voters, num_issues = votes.shape
+    total_budget = int(votes[0].sum())
+    minima = [max(1, int(minimum)) for minimum in minima]
+    voters_by_vote = [np.argsort(-votes[:,issue], kind="stable") for issue in range(num_issues)]
+    minus_sorted_votes = [-votes[voters_by_vote[issue], issue] for issue in range(num_issues)]   # increasing
+    def approvers(issue, part):
+        # the voters whose vote for the issue is at least part
+        return voters_by_vote[issue][:np.searchsorted(minus_sorted_votes[issue], -part, side="right")]
+    def cost(issue, part):
+        return minima[issue] if part==minima[issue] else 1
+
+    budget = np.full(num_voters, total_budget / num_voters)
+    remaining = {} # map a remaining candidate (issue, part) to previous effective vote count
+    for issue in range(num_issues):
+        for part in range(minima[issue], minima[issue]+2):
+            if part <= total_budget and len(approvers(issue, part)) > 0:
+                remaining[(issue, part)] = len(approvers(issue, part))
+    highest_funded = {issue: 0 for issue in range(num_issues)}
+    num_rounds = 0
+    while True:
+        best = []
+        best_eff_vote_count = 0
+        # go through remaining candidates in order of decreasing previous effective vote count
+        for candidate in sorted(remaining, key=lambda candidate: remaining[candidate], reverse=True):
+            if remaining[candidate] < best_eff_vote_count:
+                # candidate cannot be better than the best so far
+                break
+            sorted_budgets = np.sort(budget[approvers(*candidate)])
+            money_behind_now = sum(sorted_budgets.tolist())
+            eff_vote_count = None if money_behind_now < cost(*candidate) else effective_vote_count(cost(*candidate), sorted_budgets)
+            if eff_vote_count is None:
+                # not affordable; neither are the later units of the same issue, as they have fewer approvers
+                del remaining[candidate]
+                continue
+            remaining[candidate] = eff_vote_count
+            if eff_vote_count > best_eff_vote_count:
+                best_eff_vote_count = eff_vote_count
+                best = [candidate]
+            elif eff_vote_count == best_eff_vote_count:
+                best.append(candidate)
+        if not best:
+            # no remaining candidates are affordable
+            break
+        # break ties in favor of lower cost, then higher vote count, then lower (issue, part)
+        best = min(best, key=lambda candidate: (cost(*candidate), -len(approvers(*candidate)), candidate))
+        (issue, part) = best
+        num_rounds += 1
+        del remaining[best]
+        best_max_payment = cost(issue, part) / best_eff_vote_count
+        approvers_of_best = approvers(issue, part)
+        budgets_of_best = budget[approvers_of_best]
+        num_approvers = len(approvers_of_best)
+        payers = budgets_of_best > 0
+        num_payers = np.count_nonzero(payers)
+        units = 1
+        if part > minima[issue] and num_payers > 0 and budgets_of_best[payers].min() >= 1 / num_payers:
+            # All approvers with money pay equally (1/num_payers). Unit part+j has the same approvers and the same effective vote count,
+            # if no approver's vote is below part+j and, after j payments, the payers are still affordable and can pay 1/num_payers each.
+            # Budgets only decrease, so no other candidate can overtake these units, and the run is funded in one round;
+            # its payments are replayed exactly as repeated float subtractions, so the outcome is the same as funding the units one by one.
+            def pays_equally(j):
+                budgets = np.sort(repeated_subtraction(budgets_of_best[payers], best_max_payment, j))
+                return sum(budgets.tolist()) >= 1 and budgets[0] >= 1 / num_payers
+            max_units = int(min(-minus_sorted_votes[issue][num_approvers-1], total_budget)) - part + 1
+            units = max(1, min(max_units, math.floor((budgets_of_best[payers].min() - 1 / num_payers) / best_max_payment) + 1))
+            # the estimate is off by at most a unit or so, due to rounding errors
+            while units > 1 and not pays_equally(units-1):
+                units -= 1
+            while units < max_units and pays_equally(units):
+                units += 1
+            budgets_of_best[payers] = repeated_subtraction(budgets_of_best[payers], best_max_payment, units-1)
+        last_part = part + units - 1
+        highest_funded[issue] = max(highest_funded[issue], last_part)
+        if part > minima[issue] and last_part < total_budget and len(approvers(issue, last_part+1)) > 0:
+            remaining[(issue, last_part+1)] = best_eff_vote_count   # an upper bound, as the next unit has at most as many approvers
+        # charge the approvers of best (the payments of all units of the run but the last were subtracted above)
+        budget[approvers_of_best] = np.where(budgets_of_best > best_max_payment, budgets_of_best - best_max_payment, 0)
+        if trace is not None:
+            trace({"B": total_budget, "round": num_rounds, "chosen": [issue, last_part], "units": units,
+                   "eff_vote_count": best_eff_vote_count, "money_left": float(budget.sum())})
+    return highest_funded
+
+
+
+class JsonlTraceSink:
+    """
+    A trace subscriber that writes every record as a line of JSON, for offline analysis.
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> equal_shares_fixed_budget([1,2], ["x","y"], {"x":10,"y":30}, {"x":[1,2],"y":[2]}, B=40, trace=JsonlTraceSink(out))
+    ['x']
+    >>> print(out.getvalue(), end="")
+    {"B": 40, "round": 1, "chosen": "x", "eff_vote_count": 2.0, "money_left": 30.0}
+
+    When given a path, use it as a context manager (or call close), so that the file is flushed and closed:
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "trace.jsonl")
+    >>> with JsonlTraceSink(path) as sink:
+    ...     equal_shares_fixed_budget([1,2], ["x","y"], {"x":10,"y":30}, {"x":[1,2],"y":[2]}, B=40, trace=sink)
+    ['x']
+    >>> open(path).read()
+    '{"B": 40, "round": 1, "chosen": "x", "eff_vote_count": 2.0, "money_left": 30.0}\\n'
+    """
+    def __init__(self, file):
+        """
+        :param file: a file object open for writing text, or a path of a file to create.
+        """
+        self.owns_file = isinstance(file, str)
+        self.file = open(file, "w") if self.owns_file else file
+
+    def __call__(self, record:dict):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        """
+        Flush the records; close the file if it was opened by this sink (a given file object is left open).
+        """
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+
 def random_partition(total_budget:int, count:int):
     """
     >>> np.random.seed(1)
@@ -0,0 +1,45 @@
+#!python3
+
+"""
+Benchmark of the engines of equal_shares_fixed_budget on random approval elections.
+
+Usage:
+    python equalshares_benchmark.py [NUM_VOTERS] [NUM_PROJECTS] [DENSITY]
+
+DENSITY is the average fraction of the voters who approve a project.
+"""
+
+import random, sys, time
+from equalshares import equal_shares_fixed_budget
+
+
+def random_election(num_voters:int, num_projects:int, density:float, seed:int=1)->dict:
+    """
+    A random election: each project is approved by a uniformly random number of voters (between 0 and 2*density*num_voters),
+    its cost is a random multiple of 1000, and the budget is an eighth of the total cost.
+    """
+    rng = random.Random(seed)
+    N = list(range(num_voters))
+    C = [f"p{j}" for j in range(num_projects)]
+    approvers = {c: sorted(rng.sample(N, int(2 * density * num_voters * rng.random()))) for c in C}
+    cost = {c: rng.randint(1, 100) * 1000 for c in C}
+    return {"N": N, "C": C, "cost": cost, "approvers": approvers, "B": sum(cost.values()) // 8}
+
+
+if __name__ == "__main__":
+    num_voters = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_projects = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    density = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    election = random_election(num_voters, num_projects, density)
+    print("{} voters, {} projects, {} approvals".format(num_voters, num_projects, sum(len(a) for a in election["approvers"].values())))
+
+    winners = {}
+    for engine in ["sorted", "heap"]:
+        start = time.perf_counter()
+        winners[engine] = equal_shares_fixed_budget(**election, engine=engine)
+        print("{}: {:.3f} seconds, {} winners".format(engine, time.perf_counter() - start, len(winners[engine])))
+    assert winners["sorted"] == winners["heap"]
+
+    start = time.perf_counter()
+    winners["exact"], exact_rounds = equal_shares_fixed_budget(**election, engine="exact", return_exact_rounds=True)
+    print("exact: {:.3f} seconds, {} winners, {} rounds decided exactly".format(time.perf_counter() - start, len(winners["exact"]), exact_rounds))
@@ -0,0 +1,124 @@
+#!python3
+
+"""
+A streaming reader for participatory-budgeting elections in the Pabulib format (http://pabulib.org/format).
+
+A .pb file has three sections, each starting with a title line and a header line:
+META (key;value), PROJECTS (project_id;cost;...) and VOTES (voter_id;...;vote),
+where "vote" is a comma-separated list of project ids.
+
+Usage:
+    python pabulib.py ELECTION.pb [--mmap]
+"""
+
+import csv, mmap, sys, time
+
+from equalshares import equal_shares
+
+
+SECTIONS = ["META", "PROJECTS", "VOTES"]
+
+
+def number(text:str):
+    """
+    >>> number("100"), number("2.5")
+    (100, 2.5)
+    """
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_pabulib(lines)->dict:
+    """
+    Parse an approval election in the Pabulib format, in a single pass over the given lines.
+    Only the structures that the engines of equalshares.py need are kept; the raw text is not.
+
+    :param lines: an iterable of text lines (e.g. an open file).
+    :return: a dict with the arguments of equal_shares: N (voters), C (projects), cost, approvers, B (budget).
+
+    >>> lines = '''META
+    ... key;value
+    ... description;"A small example; with a semicolon"
+    ... num_projects;3
+    ... num_votes;4
+    ... budget;600
+    ... vote_type;approval
+    ... PROJECTS
+    ... project_id;cost;name
+    ... x;100;Park
+    ... y;200;Library
+    ... z;300;Pool
+    ... VOTES
+    ... voter_id;age;vote
+    ... 1;30;x,y
+    ... 2;40;y
+    ... 3;50;z
+    ... 4;60;
+    ... '''.splitlines(keepends=True)
+    >>> election = parse_pabulib(lines)
+    >>> election["N"], election["C"], election["cost"], election["B"]
+    (['1', '2', '3', '4'], ['x', 'y', 'z'], {'x': 100, 'y': 200, 'z': 300}, 600)
+    >>> election["approvers"]
+    {'x': ['1'], 'y': ['1', '2'], 'z': ['3']}
+    >>> equal_shares(**election)
+    ['y', 'x', 'z']
+    """
+    meta = {}
+    N, C, cost, approvers = [], [], {}, {}
+    section = header = None
+    for row in csv.reader(lines, delimiter=";"):
+        if not row or not row[0].strip():
+            continue
+        if len(row)==1 and row[0].strip().upper() in SECTIONS:
+            section = row[0].strip().upper()
+            header = None
+            if section!="META" and meta.get("vote_type", "approval")!="approval":
+                raise ValueError(f"Only approval elections are supported, not {meta['vote_type']}")
+            continue
+        if header is None:
+            header = [field.strip() for field in row]
+            if section=="PROJECTS":
+                project_column, cost_column = header.index("project_id"), header.index("cost")
+            elif section=="VOTES":
+                voter_column, vote_column = header.index("voter_id"), header.index("vote")
+            continue
+        if section=="META":
+            meta[row[0].strip()] = row[1].strip()
+        elif section=="PROJECTS":
+            project = row[project_column].strip()
+            C.append(project)
+            cost[project] = number(row[cost_column].strip())
+            approvers[project] = []
+        elif section=="VOTES":
+            voter = row[voter_column].strip()
+            N.append(voter)
+            vote = row[vote_column].strip() if vote_column < len(row) else ""
+            for project in vote.split(","):
+                if project:
+                    approvers[project.strip()].append(voter)
+    return {"N": N, "C": C, "cost": cost, "approvers": approvers, "B": number(meta["budget"])}
+
+
+def read_pabulib(path:str, use_mmap:bool=False)->dict:
+    """
+    Read an approval election from a .pb file (see parse_pabulib).
+    With use_mmap=True, the file is memory-mapped and read line by line, which suits multi-GB files.
+    """
+    if use_mmap:
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return parse_pabulib(line.decode("utf-8") for line in iter(mapped.readline, b""))
+    with open(path, newline="", encoding="utf-8") as file:
+        return parse_pabulib(file)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    election = read_pabulib(sys.argv[1], use_mmap="--mmap" in sys.argv)
+    loaded = time.perf_counter()
+    winners = equal_shares(**election)
+    computed = time.perf_counter()
+    print("{} voters, {} projects, budget {}".format(len(election["N"]), len(election["C"]), election["B"]))
+    print("Load time: {:.3f}s, compute time: {:.3f}s".format(loaded - start, computed - loaded))
+    print("Winners: ", winners)
@@ -8,7 +8,8 @@ Since: 2019-12
 """
 
 
-import itertools, collections, powerset
+import itertools, collections
+import numpy as np
 from dicttools import stringify  # Install dicttools from here: https://github.com/trzemecki/dicttools
 
 import logging
@@ -18,13 +19,15 @@ logger = logging.getLogger(__name__)
 import shapley
 
 
-def shapley_values_inefficient(map_player_to_cost:dict):
+def shapley_values_inefficient(map_player_to_cost:dict, engine:str="subsets"):
 	"""
 	Calculates the Shapley values for all players in an instance of the airport problem.
-	NOTE: values are calculated inefficiently, by creating an instance of the generic Shapley value problem.
+	NOTE: values are calculated inefficiently, by creating an instance of the generic Shapley value problem,
+	with a cost function that is called once on every subset.
 	This is done for demonstration purposes only.
 
 	:param map_player_to_cost:  a dict where each key is a char representing a single player, and its value is the cost of that player (alone).
+	:param engine: the engine of shapley.values; "permutations" logs the marginal costs in every permutation.
 	:return: a dict where each key is a single char representing a player, and each value is the player's Shapley value.
 
 	>>> stringify(shapley_values_inefficient({"a": 3}))
@@ -37,17 +40,67 @@ def shapley_values_inefficient(map_player_to_cost:dict):
 	'{a:1.0, b:11.0, c:111.0}'
 	"""
 	all_players = map_player_to_cost.keys()
-	map_subset_to_cost = {
-		"".join(sorted(subset)): max([map_player_to_cost[player] for player in subset])
-		for subset in powerset.powerset(all_players)
-		if len(subset)>0
-	}
-	map_subset_to_cost[""] = 0
-	# print(map_subset_to_cost)
-	return shapley.values(all_players, map_subset_to_cost)
+	subset_cost = lambda subset: max([map_player_to_cost[player] for player in subset], default=0)
+	return shapley.values(all_players, subset_cost, engine)
+
+
+def shapley_values_efficient(map_player_to_cost:dict):
+	"""
+	Calculates the Shapley values for all players in an instance of the airport problem,
+	using the closed formula of Littlechild and Owen (1973): with the costs sorted as c_1 <= ... <= c_n (and c_0 = 0),
+	the player with cost c_k pays sum_{j=1..k} (c_j - c_{j-1}) / (n-j+1),
+	i.e., every segment of the runway is shared equally among all players who need it.
+
+	:param map_player_to_cost:  a dict where each key is a char representing a single player, and its value is the cost of that player (alone).
+	:return: a dict where each key is a single char representing a player, and each value is the player's Shapley value.
+
+	>>> stringify(shapley_values_efficient({"a": 3}))
+	'{a:3.0}'
+
+	>>> stringify(shapley_values_efficient({"a": 3, "b": 23}))
+	'{a:1.5, b:21.5}'
+
+	>>> stringify(shapley_values_efficient({"a": 3, "b": 23, "c": 123}))
+	'{a:1.0, b:11.0, c:111.0}'
+	"""
+	players = list(map_player_to_cost.keys())
+	values = shapley_values_of_costs(np.array([map_player_to_cost[player] for player in players], dtype=float))
+	return {player: float(value) for player,value in zip(players, values)}
+
+
+def shapley_values_of_costs(costs:np.ndarray)->np.ndarray:
+	"""
+	The Littlechild-Owen formula on an array of costs: O(n log n) time, vectorized.
+	Suitable for millions of players.
+
+	:param costs: costs[i] is the cost of player i (alone).
+	:return: an array whose i-th element is the Shapley value of player i.
+
+	>>> shapley_values_of_costs(np.array([109, 3, 9, 9])).tolist()
+	[102.75, 0.75, 2.75, 2.75]
+	"""
+	order = np.argsort(costs, kind="stable")
+	sorted_costs = costs[order]
+	num_players = len(costs)
+	shares = np.diff(sorted_costs, prepend=0) / np.arange(num_players, 0, -1)   # segment j is shared by the n-j+1 players who need it
+	values = np.empty(num_players)
+	values[order] = np.cumsum(shares)
+	return values
 
 
 if __name__ == "__main__":
     import doctest
     (failures,tests) = doctest.testmod(report=True)
     print ("{} failures, {} tests".format(failures,tests))
+
+    import random, time
+    for num_players in range(1, 9):
+        map_player_to_cost = {chr(ord("a")+i): random.randint(1, 100) for i in range(num_players)}
+        inefficient = shapley_values_inefficient(map_player_to_cost)
+        efficient = shapley_values_efficient(map_player_to_cost)
+        assert all(abs(inefficient[player]-efficient[player]) < 1e-9 for player in map_player_to_cost), (inefficient, efficient)
+    print("The efficient and inefficient calculations agree for up to 8 players")
+    costs = np.random.uniform(1, 1000, 10**6)
+    start = time.perf_counter()
+    values = shapley_values_of_costs(costs)
+    print("{} players: {:.3f} seconds".format(len(costs), time.perf_counter()-start))
@@ -1,6 +1,8 @@
 """
 Implementation of a power-set iterator, from here:
 https://stackoverflow.com/a/18035641/827927
+
+and of iterators over subsets as bitmasks: in Gray-code order, with incremental updates, and in order of size.
 """
 
 from itertools import chain, combinations
@@ -13,3 +15,54 @@ def powerset(iterable):
     s = list(iterable)
     return chain.from_iterable(combinations(s, r) for r in range(len(s)+1))
 
+
+
+def by_size(num_items:int):
+    """
+    Iterate over all subsets of range(num_items) as bitmasks, in order of size (popcount), and in lexicographic order within each size.
+
+    >>> [bin(mask) for mask in by_size(3)]
+    ['0b0', '0b1', '0b10', '0b100', '0b11', '0b101', '0b110', '0b111']
+    """
+    for size in range(num_items+1):
+        for items in combinations(range(num_items), size):
+            yield sum(1 << item for item in items)
+
+
+def gray_code(num_items:int):
+    """
+    Iterate over all subsets of range(num_items) as bitmasks, in Gray-code order:
+    every subset differs from the previous one by a single item.
+
+    :return: a generator of (mask, item, added) triples: item is the item that was added (added=True) or removed (added=False)
+             to get mask from the previous subset. The first triple is (0, None, None).
+
+    >>> [bin(mask) for mask,_,_ in gray_code(3)]
+    ['0b0', '0b1', '0b11', '0b10', '0b110', '0b111', '0b101', '0b100']
+    >>> list(gray_code(2))
+    [(0, None, None), (1, 0, True), (3, 1, True), (2, 0, False)]
+    """
+    mask = 0
+    yield mask, None, None
+    for step in range(1, 1 << num_items):
+        item = (step & -step).bit_length() - 1
+        mask ^= 1 << item
+        yield mask, item, bool(mask >> item & 1)
+
+
+def walk(num_items:int, add, remove):
+    """
+    Iterate over all subsets in Gray-code order, calling add(item) or remove(item) before yielding each subset,
+    so that a quantity that is additive over items (a cost, a vote count) can be updated in O(1) per subset.
+
+    >>> costs = [1, 10, 100]
+    >>> total = [0]
+    >>> def add(item): total[0] += costs[item]
+    >>> def remove(item): total[0] -= costs[item]
+    >>> [(mask, total[0]) for mask in walk(3, add, remove)]
+    [(0, 0), (1, 1), (3, 11), (2, 10), (6, 110), (7, 111), (5, 101), (4, 100)]
+    """
+    for mask, item, added in gray_code(num_items):
+        if added is not None:
+            (add if added else remove)(item)
+        yield mask
@@ -16,7 +16,6 @@ Since: 2019-12
 
 import shapley
 
-import powerset
 from dicttools import stringify  # Install dicttools from here: https://github.com/trzemecki/dicttools
 
 import logging
@@ -26,6 +25,8 @@ logger = logging.getLogger(__name__)
 
 import networkx
 from networkx import DiGraph
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
 
 
 def path_cost(road_graph: DiGraph, path: list)->float:
@@ -65,14 +66,16 @@ def sublist(the_list:list, the_set:set)->list:
 
 
 
-def shapley_values_inefficient(road_graph:DiGraph, path:list):
+def shapley_values_inefficient(road_graph:DiGraph, path:list, engine:str="subsets"):
 	"""
 	Calculates the Shapley values for all players in an instance of the ride-sharing problem.
-	NOTE: values are calculated inefficiently, by constructing an instance of the generic Shapley value problem.
+	NOTE: values are calculated inefficiently, by constructing an instance of the generic Shapley value problem,
+	with a cost function that is called once on every subset.
 	This is done for demonstration purposes only.
 
 	:param road_graph:  a weighted directed graph, representing travel costs between destinations.
 	:param path: the first element is the source; then comes the list of passangers, in the fixed order by which they should be dropped from the taxi.
+	:param engine: the engine of shapley.values; "permutations" logs the marginal costs in every permutation.
 	:return: a dict where each key is a single char representing a passanger, and each value is the player's Shapley value.
 
 	>>> road_graph = DiGraph()
@@ -88,19 +91,88 @@ def shapley_values_inefficient(road_graph:DiGraph, path:list):
 	"""
 	source = path[0]
 	players = path[1:]
-	map_subset_to_cost = {
-		"".join(sorted(subset)): path_cost(road_graph, [source]+sublist(players, subset))
-		for subset in powerset.powerset(players)
-		if len(subset)>0
-	}
-	map_subset_to_cost[""] = 0
-	return shapley.values("".join(players), map_subset_to_cost)
+	subset_cost = lambda subset: path_cost(road_graph, [source]+sublist(players, subset))
+	return shapley.values(players, subset_cost, engine)
+
+
+def subset_costs(distances:np.ndarray)->np.ndarray:
+	"""
+	Calculate the travel cost of every subset of passengers, by dynamic programming over bitmasks.
+	Since the drop-off order is fixed, the cost of a subset S whose last passenger is h
+	is the cost of S without h, plus the distance from the previous passenger in S (or the source) to h.
+
+	:param distances: a matrix whose [i,k] element is the distance from the i-th node of the path to the k-th node (0 is the source).
+	:return: an array indexed by bitmask (bit i = the (i+1)-th node of the path), with the cost of every subset.
+
+	>>> subset_costs(np.array([[0, 5, 9], [0, 0, 6], [0, 6, 0]])).tolist()
+	[0.0, 5.0, 9.0, 11.0]
+	"""
+	num_players = len(distances) - 1
+	costs = np.zeros(1 << num_players)
+	last_node = np.zeros(1 << num_players, dtype=np.int64)    # the path index of the last passenger in every subset (0 if empty)
+	for h in range(num_players):
+		first, end = 1 << h, 2 << h
+		costs[first:end] = costs[:first] + distances[last_node[:first], h+1]
+		last_node[first:end] = h+1
+	return costs
+
+
+def shapley_values_by_subsets(road_graph:DiGraph, path:list):
+	"""
+	Calculates the Shapley values for all players in an instance of the ride-sharing problem,
+	with the generic subset-weighted Shapley formula (shapley.values_from_table) on the costs from subset_costs.
+	This takes O(k*2^k) time, so it can cross-check shapley_values_efficient for about 20 passengers.
+
+	>>> road_graph = DiGraph()
+	>>> road_graph.add_edge("0", "a", weight=5)
+	>>> road_graph.add_edge("0", "b", weight=9)
+	>>> road_graph.add_edge("a", "b", weight=6)
+	>>> road_graph.add_edge("b", "a", weight=6)
+	>>> stringify(shapley_values_by_subsets(road_graph, ["0", "a", "b"]))
+	'{a:3.5, b:7.5}'
+
+	>>> stringify(shapley_values_by_subsets(road_graph, ["0", "b", "a"]))
+	'{a:5.5, b:9.5}'
+	"""
+	distances = distance_matrix(road_graph, path)
+	if np.isinf(distances[np.triu_indices(len(path), 1)]).any():
+		raise networkx.NetworkXNoPath("Some destination on the path is unreachable")
+	return dict(zip(path[1:], shapley.values_from_table(subset_costs(distances)).tolist()))
+
+
+def distance_matrix(road_graph:DiGraph, nodes:list)->np.ndarray:
+	"""
+	Calculate the shortest-path distances between the given nodes, with a single multi-source Dijkstra run.
+
+	:param road_graph:  a weighted directed graph, representing travel costs between destinations.
+	:param nodes: a list of nodes of the graph.
+	:return: a matrix whose [i,k] element is the distance from nodes[i] to nodes[k] (inf if there is no path).
+
+	>>> road_graph = DiGraph()
+	>>> road_graph.add_edge("0", "a", weight=5)
+	>>> road_graph.add_edge("a", "b", weight=6)
+	>>> distance_matrix(road_graph, ["0", "a", "b"]).tolist()
+	[[0.0, 5.0, 11.0], [inf, 0.0, 6.0], [inf, inf, 0.0]]
+	"""
+	all_nodes = list(road_graph.nodes)
+	node_index = {node: i for i,node in enumerate(all_nodes)}
+	indices = [node_index[node] for node in nodes]
+	adjacency = networkx.to_scipy_sparse_array(road_graph, nodelist=all_nodes, weight="weight")
+	return dijkstra(adjacency, directed=True, indices=indices)[:, indices]
 
 
 def shapley_values_efficient(road_graph:DiGraph, path:list):
 	"""
 	Calculates the Shapley values for all players in an instance of the ride-sharing problem.
-	Uses an efficient calculation, based on Levinger, Hazon, and Azaria (2019)
+	Uses an efficient calculation, based on Levinger, Hazon, and Azaria (2019):
+
+	* Player k adds d[0,k] whenever he is first among 1,...,k, which happens in 1/k of the orders;
+	  each player j<k removes d[0,k] whenever he is first among 1,...,k-1 that comes after k, which happens in 1/k(k-1) of the orders.
+	* Players i<k add d[i,k] whenever i is second and k is first among i,...,k, which happens in 1/(k-i+1)(k-i) of the orders;
+	  each player j with i<j<k removes d[i,k] whenever he is first among i+1,...,k-1 that comes after i,k.
+
+	All distances are computed once (see distance_matrix), and the sums over j are computed with prefix sums,
+	so the time is O(k^2) for k passengers, besides the shortest-path computation.
 
 	:param road_graph:  a weighted directed graph, representing travel costs between destinations.
 	                    "0" denotes the source; all other nodes are destinations.
@@ -118,31 +190,77 @@ def shapley_values_efficient(road_graph:DiGraph, path:list):
 	>>> stringify(shapley_values_efficient(road_graph, ["0", "b", "a"]))
 	'{a:5.5, b:9.5}'
 	"""
-	source = path[0]
-	# NOTE: player index starts at 1. Source is 0.
-	map_player_to_value = {player:0.0 for player in path[1:]}
+	return dict(zip(path[1:], shapley_values_of_distances(distance_matrix(road_graph, path)).tolist()))
+
+
+def shapley_values_of_distances(distances:np.ndarray)->np.ndarray:
+	"""
+	The efficient ride-sharing Shapley values (see shapley_values_efficient), given the distance matrix of the path.
+
+	:param distances: a matrix whose [i,k] element is the distance from the i-th node of the path to the k-th node (0 is the source).
+	:return: an array whose (k-1)-th element is the Shapley value of the k-th node of the path.
 
-	for k in range(1, len(path)):  # NOTE: player index starts at 1. Source is 0.
-		d_0_k = networkx.dijkstra_path_length(road_graph, source, path[k])
-		logger.info("Calculate Shapley-values for sub-problem with only d[0,%d] (= %f):", k, d_0_k)
+	>>> shapley_values_of_distances(np.array([[0, 5, 9], [0, 0, 6], [0, 6, 0]])).tolist()
+	[3.5, 7.5]
+	"""
+	size = len(distances)
+	i, k = np.indices((size, size))
+	gap = k - i
+	if np.isinf(distances[gap>0]).any():
+		raise networkx.NetworkXNoPath("Some destination on the path is unreachable")
+	values = np.zeros(size)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		# d[0,k]:
+		positions = np.arange(size)
+		share = np.zeros(size)
+		share[1:] = distances[0, 1:] / positions[1:]
+		values += share
+		removal = np.zeros(size)
+		removal[2:] = distances[0, 2:] / positions[2:] / (positions[2:]-1)
+		values -= np.cumsum(removal[::-1])[::-1] - removal     # player j removes the shares of all k>j
+		# d[i,k] for 1 <= i < k:
+		pair_share = np.where((i>=1) & (gap>=1), distances / (gap+1) / gap, 0)
+		values += pair_share.sum(axis=1) + pair_share.sum(axis=0)
+		pair_removal = np.where((i>=1) & (gap>=2), 2 * pair_share / (gap-1), 0)
+		later_removals = np.cumsum(pair_removal[:, ::-1], axis=1)[:, ::-1] - pair_removal    # [i,j] = sum of pair_removal[i,k] for k>j
+		earlier_removals = np.cumsum(later_removals, axis=0) - later_removals                 # [i,j] = sum of later_removals[i',j] for i'<i
+		values -= earlier_removals[np.arange(size), np.arange(size)]
+	if logger.isEnabledFor(logging.INFO):
+		log_explanation(distances)
+	return values[1:]
+
+
+def log_explanation(distances:np.ndarray):
+	"""
+	Log how every distance of the path contributes to the Shapley values (see shapley_values_efficient), term by term.
+	This takes O(k^3) time, so it is meant for small demonstrations.
+	"""
+	for k in range(1, len(distances)):  # NOTE: player index starts at 1. Source is 0.
+		logger.info("Calculate Shapley-values for sub-problem with only d[0,%d] (= %f):", k, distances[0,k])
 		logger.info("  Player %d adds d[0,%d] whenever he is first among 1,...,%d, which happens in 1/%d of the orders.", k, k, k, k)
-		map_player_to_value[path[k]] += d_0_k / k  # player k adds d_0_k whenever he is first among 1,...,k, which happens in 1/k of the orders.
-		for j in range(1, k):                          # each player j<k removes d_0_k whenever he is first among 1,...,k-1 that comes after k.
+		for j in range(1, k):
 			logger.info("  Player %d removes d[0,%d] whenever he is first among 1,...,%d-1 that comes after %d.", j, k, k, k)
-			map_player_to_value[path[j]] -= d_0_k / k / (k-1)  # This happens in 1/k(k-1) of the orders.
-
 		for i in range(1, k):
-			d_i_k = networkx.dijkstra_path_length(road_graph, path[i], path[k])
-			logger.info("Calculate Shapley-values for sub-problem with only d[%d,%d] (= %f):", i, k, d_i_k)
+			logger.info("Calculate Shapley-values for sub-problem with only d[%d,%d] (= %f):", i, k, distances[i,k])
 			logger.info("  Player %d adds d[%d,%d] whenever %d is second and %d is first among %d,...,%d, which happens in 1/(%d-%d+1)/(%d-%d) of the orders.", i, i,k, i,k, i,k, k,i, k,i)
-			map_player_to_value[path[i]] += d_i_k / (k-i+1) / (k-i)
-			map_player_to_value[path[k]] += d_i_k / (k-i+1) / (k-i)
-			for j in range(i+1, k):                         # each player j with i<j<k removes d_i_k whenever he is first among i+1,...,k-1 that comes after i,k.
-				map_player_to_value[path[j]] -= d_i_k / (k-i+1) / (k-i) / (k-i-1) * 2
-	return map_player_to_value
+			for j in range(i+1, k):
+				logger.info("  Player %d removes d[%d,%d] whenever he is first among %d+1,...,%d-1 that comes after %d,%d.", j, i,k, i,k, i,k)
 
 
 if __name__ == "__main__":
     import doctest
     (failures,tests) = doctest.testmod(report=True)
     print ("{} failures, {} tests".format(failures,tests))
+
+    import random, time
+    num_passengers = 20
+    road_graph = networkx.gnm_random_graph(200, 2000, directed=True, seed=1)
+    for u,v in road_graph.edges:
+        road_graph[u][v]["weight"] = random.randint(1, 20)
+    path = random.sample(list(road_graph.nodes), num_passengers+1)
+    start = time.perf_counter()
+    exact = shapley_values_by_subsets(road_graph, path)
+    middle = time.perf_counter()
+    efficient = shapley_values_efficient(road_graph, path)
+    print("{} passengers: {:.3f} seconds by subsets, {:.3f} seconds efficient, max difference {}".format(
+        num_passengers, middle-start, time.perf_counter()-middle, max(abs(exact[p]-efficient[p]) for p in path[1:])))
@@ -24,7 +24,7 @@ road_graph.add_edge("0", "a", weight=5)
 road_graph.add_edge("0", "b", weight=9)
 road_graph.add_edge("a", "b", weight=6)
 print("\n#### Inefficient calculation")
-shapley.show(ridesharing.shapley_values_inefficient(road_graph, ["0", "a", "b"]))
+shapley.show(ridesharing.shapley_values_inefficient(road_graph, ["0", "a", "b"], engine="permutations"))
 
 print("\n#### Efficient calculation")
 shapley.show(ridesharing.shapley_values_efficient(road_graph, ["0", "a", "b"]))
@@ -38,7 +38,7 @@ road_graph.add_edge("a", "b", weight=10)
 road_graph.add_edge("a", "c", weight=15)
 road_graph.add_edge("b", "c", weight=15)
 print("\n#### Inefficient calculation")
-shapley.show(ridesharing.shapley_values_inefficient(road_graph, ["0", "a", "b", "c"]))
+shapley.show(ridesharing.shapley_values_inefficient(road_graph, ["0", "a", "b", "c"], engine="permutations"))
 
 print("\n#### Efficient calculation")
 shapley.show(ridesharing.shapley_values_efficient(road_graph, ["0", "a", "b", "c"]))
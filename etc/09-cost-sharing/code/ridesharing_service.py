@@ -0,0 +1,191 @@
+#!python3
+
+"""
+Price many shared rides on the same road graph:
+shortest-path distances are cached across rides, and rides are divided among a pool of worker processes.
+"""
+
+import collections, os, time
+from multiprocessing import Pool
+
+import networkx
+from networkx import DiGraph
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from ridesharing import shapley_values_of_distances
+from dicttools import stringify  # Install dicttools from here: https://github.com/trzemecki/dicttools
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RideSharingService:
+	"""
+	A service that calculates path costs and Shapley values of rides on a fixed road graph.
+	It keeps an LRU cache that maps a source node to its distances to all nodes (a row of 8 bytes per node),
+	bounded by cache_size sources and by cache_bytes bytes.
+	With workers>0, batches of rides are priced in a process pool; every worker keeps its own cache across batches.
+
+	>>> road_graph = DiGraph()
+	>>> road_graph.add_edge("0", "a", weight=5)
+	>>> road_graph.add_edge("0", "b", weight=9)
+	>>> road_graph.add_edge("a", "b", weight=6)
+	>>> road_graph.add_edge("b", "a", weight=6)
+	>>> service = RideSharingService(road_graph, cache_size=2, workers=0)
+	>>> service.path_cost(["0", "b", "a"])
+	15.0
+	>>> results, latencies = service.price_rides([["0", "a", "b"], ["0", "b", "a"]])
+	>>> [stringify(values) for values in results]
+	['{a:3.5, b:7.5}', '{a:5.5, b:9.5}']
+	>>> sorted(latencies.keys())
+	['p50', 'p90', 'p99']
+	>>> service.cache_info()
+	{'hits': 4, 'misses': 5, 'size': 2}
+	>>> RideSharingService(road_graph, cache_bytes=48, workers=0).max_cached_sources   # every source takes 3*8 bytes
+	2
+	>>> service.path_cost(["a", "0"])
+	Traceback (most recent call last):
+	...
+	networkx.exception.NetworkXNoPath: Node 0 not reachable from a
+	"""
+
+	def __init__(self, road_graph:DiGraph, cache_size:int=1024, workers:int=None, cache_bytes:int=1<<28):
+		"""
+		:param road_graph:  a weighted directed graph, representing travel costs between destinations.
+		:param cache_size: the maximum number of sources whose distances are cached.
+		                   Every cached source takes 8*|V| bytes for a graph with |V| nodes,
+		                   so the cache holds at most min(cache_size, cache_bytes // (8*|V|)) sources (and at least one).
+		:param workers: number of worker processes for price_rides (default: number of CPUs; 0 to price in this process).
+		:param cache_bytes: the maximum memory of the cached distances, in bytes (default 256 MB).
+		                    With workers, every worker process has its own cache of this size.
+		"""
+		self.road_graph = road_graph
+		self.nodes = list(road_graph.nodes)
+		self.node_index = {node: i for i,node in enumerate(self.nodes)}
+		self.adjacency = networkx.to_scipy_sparse_array(road_graph, nodelist=self.nodes, weight="weight")
+		self.cache_size = cache_size
+		self.cache_bytes = cache_bytes
+		self.max_cached_sources = max(1, min(cache_size, cache_bytes // (8 * max(1, len(self.nodes)))))
+		self.cache = collections.OrderedDict()
+		self.hits = self.misses = 0
+		self.workers = workers
+		self.num_workers = workers if workers is not None else (os.cpu_count() or 1)   # the size of the pool
+		self.pool = None
+
+	def distances_from(self, sources:list, columns:list=None)->np.ndarray:
+		"""
+		:param columns: indices of target nodes (default: all nodes).
+		:return: a matrix whose [i,j] element is the distance from sources[i] to the node with index columns[j].
+		Only the selected columns of the cached rows are copied into the matrix.
+		Sources that are not in the cache are computed together, in a single multi-source Dijkstra run.
+		"""
+		missing = [source for source in dict.fromkeys(sources) if source not in self.cache]
+		self.misses += len(missing)
+		self.hits += len(sources) - len(missing)
+		if missing:
+			rows = dijkstra(self.adjacency, directed=True, indices=[self.node_index[source] for source in missing])
+			for source,row in zip(missing, rows):
+				self.cache[source] = row
+		if columns is None:
+			result = np.array([self.cache[source] for source in sources])
+		else:
+			result = np.array([self.cache[source][columns] for source in sources])
+		for source in sources:
+			self.cache.move_to_end(source)
+		while len(self.cache) > self.max_cached_sources:
+			self.cache.popitem(last=False)
+		return result
+
+	def distance_matrix(self, path:list)->np.ndarray:
+		"""
+		:return: a matrix whose [i,k] element is the distance from path[i] to path[k].
+		"""
+		return self.distances_from(path, [self.node_index[node] for node in path])
+
+	def path_cost(self, path:list)->float:
+		"""
+		:return: the length of traveling the path in the given order (see ridesharing.path_cost).
+		:raise networkx.NetworkXNoPath: if some destination is unreachable from the previous one.
+		"""
+		distances = self.distance_matrix(path)
+		for i in range(len(path)-1):
+			if np.isinf(distances[i, i+1]):
+				raise networkx.NetworkXNoPath(f"Node {path[i+1]} not reachable from {path[i]}")
+		return float(sum(distances[i, i+1] for i in range(len(path)-1)))
+
+	def shapley_values(self, path:list)->dict:
+		"""
+		:return: the Shapley values of the passengers in the path (see ridesharing.shapley_values_efficient).
+		"""
+		return dict(zip(path[1:], shapley_values_of_distances(self.distance_matrix(path)).tolist()))
+
+	def cache_info(self)->dict:
+		return {"hits": self.hits, "misses": self.misses, "size": len(self.cache)}
+
+	def price_rides(self, paths:list, percentiles:list=(50, 90, 99)):
+		"""
+		Calculate the Shapley values of many rides.
+
+		:param paths: a list of paths; in each path, the first element is the source, and then come the passengers in drop-off order.
+		:param percentiles: the latency percentiles to report.
+		:return: a list with the Shapley values of every ride, in the order of the paths,
+		         and a dict that maps e.g. "p99" to the 99th percentile of the per-ride latency in seconds.
+		"""
+		if self.workers==0:
+			results = [_timed_shapley_values(self, path) for path in paths]
+		else:
+			if self.pool is None:
+				self.pool = Pool(self.num_workers, initializer=_init_worker, initargs=(self.road_graph, self.cache_size, self.cache_bytes))
+			results = self.pool.map(_price_ride, paths, chunksize=max(1, len(paths) // (4*self.num_workers)))
+		latencies = [latency for _,latency in results]
+		latency_percentiles = {f"p{p}": float(np.percentile(latencies, p)) for p in percentiles} if latencies else {}
+		logger.info("%d rides, latency percentiles: %s", len(paths), latency_percentiles)
+		return [values for values,_ in results], latency_percentiles
+
+	def close(self):
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+def _timed_shapley_values(service:RideSharingService, path:list):
+	start = time.perf_counter()
+	values = service.shapley_values(path)
+	return values, time.perf_counter() - start
+
+
+_worker_service = None   # the service of the current worker process
+
+
+def _init_worker(road_graph:DiGraph, cache_size:int, cache_bytes:int):
+	global _worker_service
+	_worker_service = RideSharingService(road_graph, cache_size, workers=0, cache_bytes=cache_bytes)
+
+
+def _price_ride(path:list):
+	return _timed_shapley_values(_worker_service, path)
+
+
+if __name__ == "__main__":
+	import doctest
+	(failures,tests) = doctest.testmod(report=True)
+	print ("{} failures, {} tests".format(failures,tests))
+
+	import random
+	road_graph = networkx.gnm_random_graph(2000, 20000, directed=True, seed=1)
+	for u,v in road_graph.edges:
+		road_graph[u][v]["weight"] = random.randint(1, 20)
+	paths = [random.sample(range(100), 5) for _ in range(2000)]
+	with RideSharingService(road_graph, cache_size=200) as service:
+		for batch in range(3):
+			start = time.perf_counter()
+			results, latencies = service.price_rides(paths)
+			print("Batch {}: {} rides in {:.3f} seconds, latency percentiles {}".format(batch, len(paths), time.perf_counter()-start, latencies))
@@ -8,18 +8,76 @@ Since: 2019-12
 """
 
 
-import itertools, collections
+import itertools, collections, functools, math, os, random, statistics, time
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import powerset
 from dicttools import stringify  # Install dicttools from here: https://github.com/trzemecki/dicttools
 
 import logging
 logger = logging.getLogger(__name__)
 
+try:
+	import _shapley_kernel as _kernel   # built by shapley_kernel_build.py
+except ImportError:
+	_kernel = None
 
-def values(all_players:str, map_subset_to_cost:dict):
+
+class CostOracle:
+	"""
+	A lazy cost function for Shapley computations: wraps a function on subsets of players,
+	and evaluates it only on the subsets that are actually requested, with a bounded LRU cache keyed by bitmask.
+	The cache pays off when subsets are requested repeatedly, as in the permutation and Monte Carlo calculations;
+	the subsets engine of `values` evaluates every subset once, so it calls the wrapped function directly.
+
+	>>> oracle = CostOracle("abc", lambda subset: max([{"a": 3, "b": 23, "c": 123}[player] for player in subset], default=0), maxsize=4)
+	>>> oracle(0b011), oracle({"a","b"}), oracle("c"), oracle(frozenset())
+	(23, 23, 123, 0)
+	>>> oracle.cache_info()
+	CacheInfo(hits=1, misses=3, maxsize=4, currsize=3)
+	"""
+	def __init__(self, players, cost_function, maxsize:int=1<<16):
+		"""
+		:param players: the players; bit i of a mask represents players[i].
+		:param cost_function: a function that maps a frozenset of players to the cost of that subset.
+		:param maxsize: the maximum number of cached subsets (None for unbounded).
+		"""
+		self.players = list(players)
+		self.bits = {player: 1 << i for i,player in enumerate(self.players)}
+		self.cost_function = cost_function
+		self._cost_of_mask = functools.lru_cache(maxsize=maxsize)(self._evaluate)
+
+	def _evaluate(self, mask:int):
+		return self.cost_function(frozenset(player for i,player in enumerate(self.players) if mask >> i & 1))
+
+	def mask(self, subset)->int:
+		return sum(self.bits[player] for player in set(subset))
+
+	def __call__(self, subset):
+		"""
+		:param subset: a bitmask, or a collection of players.
+		:return: the cost of the subset.
+		"""
+		return self._cost_of_mask(subset if isinstance(subset, int) else self.mask(subset))
+
+	def cache_info(self):
+		"""
+		:return: the hits, misses, maxsize and current size of the cache.
+		"""
+		return self._cost_of_mask.cache_info()
+
+
+def values(all_players:str, map_subset_to_cost, engine:str="subsets"):
 	"""
 	Calculate the Shapley values for all players.
-	:param all_players: a string where each char represents a player.
-	:param map_subset_to_cost:  a dict where each key is a string representing a subset of players, and its value is the cost of that subset.
+	:param all_players: a string where each char represents a player (or, when the costs are given by a function, any iterable of players).
+	:param map_subset_to_cost:  a dict where each key is a string representing a subset of players, and its value is the cost of that subset;
+	                            or a function that maps a frozenset of players to its cost; or a CostOracle.
+	:param engine: "subsets" (default) sums the weighted marginal costs over the 2^n subsets (see values_from_table);
+	               a cost function is called once on every subset, without a cache (see function_table).
+	               "permutations" averages the marginal costs over the n! permutations, logging each of them;
+	               a cost function is wrapped in a CostOracle, since every subset is reached in many permutations.
 	:return: a dict where each key is a single char representing a player, and each value is the player's Shapley value.
 
 	>>> stringify(values("a", {"": 0, "a": 10}))
@@ -30,8 +88,38 @@ def values(all_players:str, map_subset_to_cost:dict):
 	'{a:10.0, b:5.0}'
 	>>> stringify(values("ab", {"": 0, "a": 10, "b": 5, "ab": 10}))
 	'{a:7.5, b:2.5}'
+	>>> stringify(values("ab", {"": 0, "a": 10, "b": 5, "ab": 10}, engine="permutations"))
+	'{a:7.5, b:2.5}'
+	>>> stringify(values("ab", lambda subset: 10 if "a" in subset else 5 if subset else 0))
+	'{a:7.5, b:2.5}'
+	"""
+	if engine=="permutations":
+		if callable(map_subset_to_cost) and not isinstance(map_subset_to_cost, CostOracle):
+			map_subset_to_cost = CostOracle(sorted(all_players), map_subset_to_cost)
+		return values_by_permutations(all_players, map_subset_to_cost)
+	elif engine!="subsets":
+		raise ValueError(f"Unknown engine: {engine}")
+	if isinstance(map_subset_to_cost, CostOracle):
+		players = map_subset_to_cost.players
+		costs = function_table(players, map_subset_to_cost.cost_function)
+	elif callable(map_subset_to_cost):
+		players = sorted(all_players)
+		costs = function_table(players, map_subset_to_cost)
+	else:
+		players = sorted(all_players)
+		costs = subset_table(players, map_subset_to_cost)
+	shapley_values = values_from_table(costs)
+	return {player: float(shapley_values[players.index(player)]) for player in all_players}
+
+
+def values_by_permutations(all_players:str, map_subset_to_cost:dict):
 	"""
+	Calculate the Shapley values for all players, by looping over all n! permutations.
+	Parameters and return value are as in `values`, except that a cost function must be given as a CostOracle.
 
+	>>> stringify(values_by_permutations("ab", {"": 0, "a": 10, "b": 5, "ab": 10}))
+	'{a:7.5, b:2.5}'
+	"""
 	map_player_to_sum_of_marginal_costs = collections.defaultdict(float)
 	num_permutations = 0
 	logger.info("Looping over all permutations of %s", list(all_players))
@@ -39,11 +127,14 @@ def values(all_players:str, map_subset_to_cost:dict):
 		# calculate marginal costs for a specific permutation:
 		logger.info("  Permutation %s: ", permutation)
 		current_cost = 0
-		current_subset = ""
+		current_subset = []
 		for player in permutation:	# loop over the players in the order given by the current permutation
 			# calculate marginal cost for a specific player in a specific permutation
-			current_subset += player
-			new_cost = map_subset_to_cost[''.join(sorted(current_subset))]
+			current_subset.append(player)
+			if isinstance(map_subset_to_cost, CostOracle):
+				new_cost = map_subset_to_cost(current_subset)
+			else:
+				new_cost = map_subset_to_cost[''.join(sorted(current_subset))]
 			marginal_cost = new_cost - current_cost
 			logger.info("    Player %s: %d", player, marginal_cost)
 			map_player_to_sum_of_marginal_costs[player] += marginal_cost
@@ -56,6 +147,241 @@ def values(all_players:str, map_subset_to_cost:dict):
 	return map_player_to_sum_of_marginal_costs
 
 
+def subset_table(players:list, map_subset_to_cost:dict)->np.ndarray:
+	"""
+	Convert a dict of subset costs into an array indexed by bitmask, where bit i represents players[i].
+	:param players: a sorted list of single-char players.
+
+	>>> subset_table(["a","b"], {"": 0, "a": 10, "b": 5, "ab": 12}).tolist()
+	[0.0, 10.0, 5.0, 12.0]
+	"""
+	keys = [""]
+	for i in range(len(players)):
+		keys += [key + players[i] for key in keys]   # the players in every key remain sorted
+	return np.array([map_subset_to_cost[key] for key in keys], dtype=float)
+
+
+def function_table(players:list, cost_function)->np.ndarray:
+	"""
+	Evaluate a cost function on every subset of players, into an array indexed by bitmask, where bit i represents players[i].
+	Every subset is evaluated exactly once, so the function is called directly, without a cache.
+	The subsets are visited in Gray-code order (see powerset.walk), and the set of players is updated by adding or removing one player per step;
+	but the cost function gets a new frozenset of every subset, so the table takes O(|S|) time per subset in addition to the calls.
+	(For an additive cost, powerset.walk with add/remove callbacks updates the cost itself in O(1) per subset.)
+	:param cost_function: a function that maps a frozenset of players to the cost of that subset.
+
+	>>> function_table(["a","b"], lambda subset: 10 if "a" in subset else 5 if subset else 0).tolist()
+	[0.0, 10.0, 5.0, 10.0]
+	"""
+	costs = np.zeros(1 << len(players))
+	subset = set()
+	for mask in powerset.walk(len(players), lambda i: subset.add(players[i]), lambda i: subset.remove(players[i])):
+		costs[mask] = cost_function(frozenset(subset))
+	return costs
+
+
+def popcounts(num_players:int)->np.ndarray:
+	"""
+	:return: an array with the number of players in every subset (bitmask).
+
+	>>> popcounts(3).tolist()
+	[0, 1, 1, 2, 1, 2, 2, 3]
+	"""
+	counts = np.zeros(1 << num_players, dtype=np.uint8)
+	for i in range(num_players):
+		counts.reshape(-1, 2, 1 << i)[:, 1, :] += 1
+	return counts
+
+
+def shapley_weights(num_players:int):
+	"""
+	:return: two arrays indexed by subset size k, multiplied by n!:
+	         the weight of a subset of size k containing a player plus the weight of a subset of size k not containing a player,
+	         and the weight of a subset of size k not containing a player.
+
+	>>> [array.tolist() for array in shapley_weights(2)]
+	[[1.0, 2.0, 1.0], [1.0, 1.0, 0.0]]
+	"""
+	factorial = math.factorial
+	weight_in = [0] + [factorial(k-1)*factorial(num_players-k) for k in range(1, num_players+1)]  # subsets of size k containing i
+	weight_out = [factorial(k)*factorial(num_players-k-1) for k in range(num_players)] + [0]      # subsets of size k not containing i
+	return np.array(weight_in, dtype=float) + np.array(weight_out, dtype=float), np.array(weight_out, dtype=float)
+
+
+def values_from_table(costs:np.ndarray, use_kernel:bool=True)->np.ndarray:
+	"""
+	Calculate the Shapley values from an array of subset costs indexed by bitmask (bit i = player i),
+	as the weighted sum over subsets:
+	    value(i) = sum_{S containing i} (|S|-1)!(n-|S|)!/n! * cost(S)  -  sum_{S not containing i} |S|!(n-|S|-1)!/n! * cost(S).
+	The weights are kept as integers (multiplied by n!) until the final division, so small integer games give exact results.
+	Takes O(n*2^n) time.
+
+	If the compiled kernel is built (see shapley_kernel_build.py) and use_kernel is True, the sums are computed in C,
+	without holding the GIL; otherwise, they are computed with NumPy.
+
+	>>> values_from_table(np.array([0, 10, 5, 10])).tolist()
+	[7.5, 2.5]
+	>>> values_from_table(np.array([0, 3, 23, 23, 123, 123, 123, 123])).tolist()
+	[1.0, 11.0, 111.0]
+	>>> values_from_table(np.array([0, 3, 23, 23, 123, 123, 123, 123]), use_kernel=False).tolist()
+	[1.0, 11.0, 111.0]
+	"""
+	num_players = len(costs).bit_length() - 1
+	weight_sum, weight_out = shapley_weights(num_players)
+	if use_kernel and _kernel is not None:
+		costs = np.ascontiguousarray(costs, dtype=float)
+		sums = np.zeros(num_players)
+		total_out = _kernel.ffi.new("double *")
+		from_buffer = _kernel.ffi.from_buffer
+		_kernel.lib.shapley_sums(from_buffer("double[]", costs), num_players, from_buffer("double[]", weight_sum),
+			from_buffer("double[]", weight_out), from_buffer("double[]", sums), total_out)
+		return (sums - total_out[0]) / math.factorial(num_players)
+	sums, total_out = _shapley_sums(costs, num_players, 0, 0)
+	return (sums - total_out) / math.factorial(num_players)
+
+
+def _shapley_sums(costs:np.ndarray, num_players:int, high_bits:int, high_mask:int):
+	"""
+	The sums of values_from_table (multiplied by n!), restricted to the subsets whose top `high_bits` bits equal high_mask;
+	costs is the slice of the cost array with these subsets.
+	"""
+	low_bits = num_players - high_bits
+	weight_sum, weight_out = shapley_weights(num_players)
+	sizes = popcounts(low_bits) + bin(high_mask).count("1")
+	total_out = (weight_out[sizes] * costs).sum()
+	weighted_costs = weight_sum[sizes] * costs
+	sums = np.zeros(num_players)
+	for i in range(low_bits):
+		sums[i] = weighted_costs.reshape(-1, 2, 1 << i)[:, 1, :].sum()
+	for i in range(high_bits):
+		if high_mask >> i & 1:
+			sums[low_bits+i] = weighted_costs.sum()
+	return sums, total_out
+
+
+def _shapley_sums_of_chunk(shared_memory_name:str, num_players:int, high_bits:int, high_mask:int):
+	shared = SharedMemory(name=shared_memory_name)
+	try:
+		chunk_size = 1 << (num_players - high_bits)
+		costs = np.ndarray(chunk_size, dtype=float, buffer=shared.buf, offset=high_mask * chunk_size * 8)
+		result = _shapley_sums(costs, num_players, high_bits, high_mask)
+		del costs
+		return result
+	finally:
+		shared.close()
+
+
+def values_from_table_parallel(costs:np.ndarray, workers:int=None, chunks_per_worker:int=4)->np.ndarray:
+	"""
+	Calculate the Shapley values like values_from_table, in a pool of worker processes.
+	The subset lattice is split by the top bits of the bitmask into contiguous chunks;
+	the cost array is placed in shared memory once, and every worker reads its chunks from there.
+	The partial sums of the chunks are added at the end.
+
+	:param workers: number of worker processes (default: number of CPUs).
+	:param chunks_per_worker: the lattice is split into at least this number of chunks per worker, for load balancing.
+
+	>>> values_from_table_parallel(np.array([0, 3, 23, 23, 123, 123, 123, 123]), workers=2).tolist()
+	[1.0, 11.0, 111.0]
+	"""
+	num_players = len(costs).bit_length() - 1
+	workers = workers or os.cpu_count()
+	high_bits = min(num_players, (chunks_per_worker*workers - 1).bit_length())
+	shared = SharedMemory(create=True, size=len(costs) * 8)
+	try:
+		shared_costs = np.ndarray(len(costs), dtype=float, buffer=shared.buf)
+		shared_costs[:] = costs
+		del shared_costs
+		with Pool(workers) as pool:
+			partial_sums = pool.starmap(_shapley_sums_of_chunk,
+				[(shared.name, num_players, high_bits, high_mask) for high_mask in range(1 << high_bits)])
+	finally:
+		shared.close()
+		shared.unlink()
+	sums = sum(sums for sums,_ in partial_sums)
+	total_out = sum(total_out for _,total_out in partial_sums)
+	return (sums - total_out) / math.factorial(num_players)
+
+
+MonteCarloResult = collections.namedtuple("MonteCarloResult", ["values", "half_widths", "num_permutations", "permutations_per_second"])
+
+
+def estimate_values(all_players, cost_function, tolerance:float, confidence:float=0.95,
+                    min_permutations:int=20, max_permutations:int=1000000, seed=None)->MonteCarloResult:
+	"""
+	Estimate the Shapley values by sampling random permutations, for games too large for `values`.
+	Every sample is an antithetic pair: a random permutation and its reverse, whose marginal costs are averaged.
+	A running mean and variance is kept per player, and sampling stops once the confidence-interval half-width
+	of every player is at most `tolerance` (or after max_permutations permutations).
+
+	:param all_players: an iterable of players.
+	:param cost_function: a function that maps a frozenset of players to the cost of that subset (possibly a CostOracle).
+	:param tolerance: the maximum half-width of the confidence interval of each value.
+	:param confidence: the confidence level of the intervals.
+	:param seed: a seed for the random permutations.
+	:return: a MonteCarloResult with a dict of estimated values, a dict of confidence-interval half-widths,
+	         the number of permutations used, and the throughput in permutations per second.
+
+	In an additive game every permutation gives the exact values, so sampling stops after min_permutations:
+	>>> costs = {"a": 3, "b": 23, "c": 123}
+	>>> result = estimate_values("abc", lambda subset: sum(costs[player] for player in subset), tolerance=0.1, seed=1)
+	>>> stringify(result.values), result.num_permutations
+	('{a:3.0, b:23.0, c:123.0}', 20)
+
+	In the airport problem (exact values: a:1, b:11, c:111):
+	>>> result = estimate_values("abc", lambda subset: max([costs[player] for player in subset], default=0), tolerance=1, seed=1)
+	>>> all(abs(result.values[player]-exact) <= 2*result.half_widths[player] for player,exact in [("a",1),("b",11),("c",111)])
+	True
+	>>> max(result.half_widths.values()) <= 1
+	True
+	"""
+	players = list(all_players)
+	num_players = len(players)
+	z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+	rng = random.Random(seed)
+	empty_cost = cost_function(frozenset())
+
+	def marginal_costs(permutation:list)->np.ndarray:
+		result = np.zeros(num_players)
+		current_cost = empty_cost
+		current_subset = set()
+		for i in permutation:
+			current_subset.add(players[i])
+			new_cost = cost_function(frozenset(current_subset))
+			result[i] = new_cost - current_cost
+			current_cost = new_cost
+		return result
+
+	num_samples = 0
+	mean = np.zeros(num_players)
+	sum_of_squares = np.zeros(num_players)   # sum of squared deviations from the mean (Welford's algorithm)
+	half_widths = np.full(num_players, np.inf)
+	start = time.perf_counter()
+	while 2*num_samples < max_permutations:
+		permutation = list(range(num_players))
+		rng.shuffle(permutation)
+		sample = (marginal_costs(permutation) + marginal_costs(permutation[::-1])) / 2
+		num_samples += 1
+		delta = sample - mean
+		mean += delta / num_samples
+		sum_of_squares += delta * (sample - mean)
+		if 2*num_samples >= min_permutations:
+			half_widths = z * np.sqrt(sum_of_squares / (num_samples - 1) / num_samples)
+			if np.all(half_widths <= tolerance):
+				break
+	else:
+		logger.warning("Stopped after %d permutations; the largest half-width is %f", 2*num_samples, half_widths.max())
+	elapsed = time.perf_counter() - start
+	num_permutations = 2*num_samples
+	logger.info("%d permutations in %f seconds (%f permutations/sec)", num_permutations, elapsed, num_permutations/elapsed)
+	return MonteCarloResult(
+		values = {player: float(mean[i]) for i,player in enumerate(players)},
+		half_widths = {player: float(half_widths[i]) for i,player in enumerate(players)},
+		num_permutations = num_permutations,
+		permutations_per_second = num_permutations/elapsed,
+	)
+
+
 def show(map_player_to_shapley_value):
 	"""
 	Print the Shapley values to screen.
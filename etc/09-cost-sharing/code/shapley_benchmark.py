@@ -0,0 +1,30 @@
+#!python3
+
+"""
+Benchmark of the parallel Shapley value calculation: the speedup as a function of the number of workers.
+
+Usage:
+    python shapley_benchmark.py [NUM_PLAYERS]
+"""
+
+import sys, time
+import numpy as np
+import shapley
+
+
+if __name__ == "__main__":
+	num_players = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+	costs = np.random.uniform(0, 100, 1 << num_players)
+	print("{} players".format(num_players))
+
+	start = time.perf_counter()
+	expected = shapley.values_from_table(costs, use_kernel=False)
+	baseline = time.perf_counter() - start
+	print("serial (NumPy): {:.3f} seconds".format(baseline))
+
+	for workers in [1, 2, 4, 8]:
+		start = time.perf_counter()
+		values = shapley.values_from_table_parallel(costs, workers=workers)
+		elapsed = time.perf_counter() - start
+		assert np.allclose(values, expected)
+		print("{} workers: {:.3f} seconds, speedup {:.2f}".format(workers, elapsed, baseline/elapsed))
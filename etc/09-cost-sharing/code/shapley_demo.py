@@ -19,7 +19,7 @@ map_subset_to_cost = {
 	"b":   9,
 	"ab":  11,
 }
-shapley.show(shapley.values("ab", map_subset_to_cost))
+shapley.show(shapley.values("ab", map_subset_to_cost, engine="permutations"))
 
 
 print("\n## Airport problem example")
@@ -33,5 +33,5 @@ map_subset_to_cost = {
 	"bc":  123,
 	"abc": 123,
 }
-shapley.show(shapley.values("abc", map_subset_to_cost))
+shapley.show(shapley.values("abc", map_subset_to_cost, engine="permutations"))
 
@@ -0,0 +1,49 @@
+#!python3
+
+"""
+Build the compiled Shapley kernel used by shapley.values_from_table:
+
+    python shapley_kernel_build.py
+
+This creates the extension module _shapley_kernel next to this file (requires cffi and a C compiler).
+Without it, shapley.values_from_table uses NumPy.
+"""
+
+import os
+from cffi import FFI
+
+ffibuilder = FFI()
+
+ffibuilder.cdef("""
+	void shapley_sums(const double *costs, int num_players, const double *weight_sum, const double *weight_out,
+	                  double *sums, double *total_out);
+""")
+
+ffibuilder.set_source("_shapley_kernel", r"""
+	#include <stdint.h>
+
+	/*
+	 * For every player i: sums[i] = sum over subsets S containing i of weight_sum[|S|]*costs[S].
+	 * *total_out = sum over all subsets S of weight_out[|S|]*costs[S].
+	 * costs is indexed by bitmask, bit i = player i.
+	 */
+	void shapley_sums(const double *costs, int num_players, const double *weight_sum, const double *weight_out,
+	                  double *sums, double *total_out) {
+		uint64_t num_subsets = (uint64_t)1 << num_players;
+		double total = 0;
+		for (uint64_t mask = 0; mask < num_subsets; mask++) {
+			int size = __builtin_popcountll(mask);
+			double cost = costs[mask];
+			double weighted_cost = weight_sum[size] * cost;
+			total += weight_out[size] * cost;
+			for (uint64_t rest = mask; rest; rest &= rest - 1)
+				sums[__builtin_ctzll(rest)] += weighted_cost;
+		}
+		*total_out = total;
+	}
+""", extra_compile_args=["-O3"])
+
+
+if __name__ == "__main__":
+	here = os.path.dirname(os.path.abspath(__file__))
+	ffibuilder.compile(tmpdir=here, verbose=True)